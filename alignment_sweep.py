@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Design space exploration of the AlignmentDetector parameters: every variant
+# of an HDMIInputChannel is simulated on synthetic links (skew, jitter, bit
+# errors, error bursts, a skew step) in a process pool, and the lock time,
+# false retrain rate, recovery time and register count are tabulated, e.g.:
+#   ./alignment_sweep.py --holdoff-bits 8,10,12 --restart-quality 12,15 > sweep.tsv
+import argparse
+import itertools
+import multiprocessing
+
+from litex.gen import *
+from litex.gen.fhdl.tools import list_targets
+
+import hdmi_sim
+from hdmi_design import HDMIInputChannel
+
+
+parameters = ["window", "holdoff_bits", "restart_quality", "lock_quality", "error_increment"]
+
+# name: (skew (ps), jitter (ps rms), bit error probability, error bursts (period, length),
+#        skew step (ps), step time (fraction of the run))
+scenarios = {
+    "clean": (200, 10, 0, None, 0, None),
+    "jitter": (200, 60, 0, None, 0, None),
+    "noise": (200, 10, 1e-4, None, 0, None),
+    "bursts": (200, 10, 0, (4096, 16), 0, None),
+    # one bit at 148.5MHz: the word alignment is lost, the channel has to retrain
+    "step": (200, 10, 0, None, 673, 0.6),
+}
+
+
+class NoisyLink(hdmi_sim.TMDSLink):
+    def __init__(self, symbols, pixel_clock, skew=0.0, jitter=0.0, seed=0,
+                 noise=0.0, bursts=None, step=0.0, step_cycle=None):
+        hdmi_sim.TMDSLink.__init__(self, symbols, pixel_clock, skew, jitter, seed)
+        self.noise = noise
+        self.bursts = bursts
+        self.step = step
+        self.step_cycle = step_cycle
+
+    def sample(self, cycle, tap, inverted=False):
+        if self.step_cycle is not None and cycle == self.step_cycle:
+            self.skew += self.step
+        word = hdmi_sim.TMDSLink.sample(self, cycle, tap, inverted)
+        if self.bursts is not None and cycle % self.bursts[0] < self.bursts[1]:
+            word ^= self.rng.getrandbits(10)
+        if self.noise:
+            for i in range(10):
+                if self.rng.random() < self.noise:
+                    word ^= 1 << i
+        return word
+
+
+def register_bits(module):
+    fragment = module.get_fragment()
+    return sum(len(s) for statements in fragment.sync.values() for s in list_targets(statements))
+
+
+def monitor(chan, ncycles, step_cycle, result):
+    result["losses"] = 0
+    result["locked_cycles"] = 0
+    locked = False
+    for cycle in range(ncycles):
+        if (yield chan.locked):
+            if not locked:
+                if "lock" not in result:
+                    result["lock"] = cycle
+                elif step_cycle is not None and cycle > step_cycle and "recovery" not in result:
+                    result["recovery"] = cycle - step_cycle
+            result["locked_cycles"] += 1
+            locked = True
+        else:
+            if locked:
+                result["losses"] += 1
+            locked = False
+        yield
+
+
+def reset(chan, ncycles=16):
+    yield chan.reset.eq(1)
+    for i in range(ncycles):
+        yield
+    yield chan.reset.eq(0)
+
+
+def run(job):
+    variant, scenario, ncycles, pixel_clock, seed = job
+    skew, jitter, noise, bursts, step, step_fraction = scenarios[scenario]
+    step_cycle = int(step_fraction*ncycles) if step_fraction is not None else None
+
+    # registers of the hardware channel, without the serdes primitives
+    result = {"registers": register_bits(HDMIInputChannel(Signal(), **variant))}
+    chan = HDMIInputChannel(Signal(), sim=True, **variant)
+    symbols, expected = hdmi_sim.generate_frames(1, seed=seed)[0]
+    link = NoisyLink(symbols, pixel_clock, skew*1e-12, jitter*1e-12, seed, noise, bursts, step*1e-12, step_cycle)
+
+    generators = [reset(chan), hdmi_sim.drive(chan, link), monitor(chan, ncycles, step_cycle, result)]
+    pix_period = 2*max(1, round(500e6/pixel_clock))
+    run_simulation(chan, {"pix": generators}, clocks={"sys": 20, "pix": pix_period})
+    return variant, scenario, result
+
+
+def _values(s):
+    return [int(v, 0) for v in s.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AlignmentDetector parameter sweep")
+    parser.add_argument("--window", default="10", help="search window (log2 cycles per tap)")
+    parser.add_argument("--holdoff-bits", default="10", help="error holdoff after lock (log2 cycles)")
+    parser.add_argument("--restart-quality", default="0xf", help="signal quality that restarts the search")
+    parser.add_argument("--lock-quality", default="0x4", help="signal quality set on lock")
+    parser.add_argument("--error-increment", default="0x100000", help="signal quality increment per error")
+    parser.add_argument("--scenarios", default=",".join(sorted(scenarios.keys())))
+    parser.add_argument("--cycles", type=int, default=120000, help="pix cycles to simulate per run")
+    parser.add_argument("--pixel-clock", type=float, default=148.5, help="pixel clock (MHz)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (default: one per cpu)")
+    args = parser.parse_args()
+
+    grid = [_values(getattr(args, name)) for name in parameters]
+    variants = [dict(zip(parameters, values)) for values in itertools.product(*grid)]
+    jobs = [(variant, scenario, args.cycles, args.pixel_clock*1e6, args.seed)
+        for variant in variants for scenario in args.scenarios.split(",")]
+
+    # false retrains are the losses of lock on links that never needed one
+    print("\t".join(parameters + ["scenario", "registers", "lock_cycles", "losses",
+                                  "false_retrains_per_mcycle", "recovery_cycles"]))
+    with multiprocessing.Pool(args.jobs) as pool:
+        for variant, scenario, result in pool.imap(run, jobs):
+            lock = result.get("lock")
+            false_retrains = result["losses"] if scenarios[scenario][5] is None else None
+            print("\t".join([str(variant[name]) for name in parameters] + [
+                scenario,
+                str(result["registers"]),
+                str(lock) if lock is not None else "-",
+                str(result["losses"]),
+                "{:.2f}".format(1e6*false_retrains/max(1, result["locked_cycles"]))
+                    if false_retrains is not None else "-",
+                str(result.get("recovery", "-"))
+            ]), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Elaboration benchmarks: times the construction, the fragment (finalization
+# and flattening of the submodules into one fragment) and the Verilog
+# conversion of the top level classes of hdmi_design.py on a dummy platform,
+# without Vivado. Every run is appended to a history file and compared with
+# the previous one, e.g.:
+#   ./benchmark.py --repeat 3 HDMILoopback
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from litex.gen import *
+from litex.gen.fhdl import verilog
+from litex.gen.fhdl.tools import list_signals
+from litex.build.xilinx.common import xilinx_special_overrides
+
+from hdmi_design import InvalidSymbolDetector, AlignmentDetector, HDMIInputChannel, HDMILoopback
+
+
+phases = ["construct", "fragment", "convert"]
+
+
+class _Pads:
+    def __init__(self, name):
+        self._name = name
+        self._signals = {}
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr not in self._signals:
+            self._signals[attr] = Signal(name=self._name + "_" + attr)
+        return self._signals[attr]
+
+
+class DummyPlatform:
+    # hands out pads whose signals are created on first use, and collects
+    # them as the ios of the conversion
+    def __init__(self):
+        self.pads = []
+        self.signals = []
+
+    def request(self, name, number=None):
+        if name in ("clk100", "cpu_reset"):
+            signal = Signal(name=name)
+            self.signals.append(signal)
+            return signal
+        pads = _Pads(name)
+        self.pads.append(pads)
+        return pads
+
+    def ios(self):
+        return {s for pads in self.pads for s in pads._signals.values()} | set(self.signals)
+
+
+def _symbol_detector(implementation):
+    def benchmark(platform):
+        symbol = Signal(10, name="symbol")
+        return InvalidSymbolDetector(symbol, implementation), {symbol}
+    return benchmark
+
+
+def _alignment_detector(platform):
+    invalid_symbols = Signal(10, name="invalid_symbols")
+    return AlignmentDetector(invalid_symbols), {invalid_symbols}
+
+
+def _input_channel(platform):
+    data = Signal(name="data")
+    return HDMIInputChannel(data), {data}
+
+
+# name: platform -> (module, ios)
+benchmarks = {
+    "InvalidSymbolDetector": _symbol_detector("rom"),
+    # one If per valid symbol
+    "InvalidSymbolDetector-compare": _symbol_detector("compare"),
+    "InvalidSymbolDetector-arithmetic": _symbol_detector("arithmetic"),
+    "AlignmentDetector": _alignment_detector,
+    "HDMIInputChannel": _input_channel,
+    "HDMILoopback": lambda platform: (HDMILoopback(platform), None)
+}
+
+
+def statements(node):
+    # number of statements of a list, counting the ones of every branch
+    if isinstance(node, (list, tuple)):
+        return sum(statements(s) for s in node)
+    if isinstance(node, If):
+        return 1 + statements(node.t) + statements(node.f)
+    if isinstance(node, Case):
+        return 1 + sum(statements(s) for s in node.cases.values())
+    return 1
+
+
+def run(name):
+    platform = DummyPlatform()
+    times = {}
+
+    started = time.perf_counter()
+    module, ios = benchmarks[name](platform)
+    times["construct"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    fragment = module.get_fragment()
+    times["fragment"] = time.perf_counter() - started
+    sizes = {
+        "comb": statements(fragment.comb),
+        "sync": statements(list(fragment.sync.values())),
+        "signals": len(list_signals(fragment)),
+        "specials": len(fragment.specials)
+    }
+
+    started = time.perf_counter()
+    output = verilog.convert(fragment, platform.ios() if ios is None else ios,
+                             special_overrides=xilinx_special_overrides)
+    times["convert"] = time.perf_counter() - started
+    sizes["lines"] = str(output).count("\n")
+    return times, sizes
+
+
+def _revision():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _last(history, name):
+    # results of the benchmark in the last recorded run that has it
+    try:
+        with open(history) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return None
+    for entry in reversed(runs):
+        if name in entry["results"]:
+            return entry["results"][name]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Elaboration and Verilog generation benchmarks")
+    parser.add_argument("benchmarks", nargs="*", default=list(benchmarks.keys()),
+                        help="benchmarks to run (default: all of " + ", ".join(benchmarks.keys()) + ")")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per benchmark, the fastest is kept")
+    parser.add_argument("--history", default="build/benchmarks.jsonl", help="results of the previous runs")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown from the previous run reported as a regression")
+    parser.add_argument("--min-delta", type=float, default=0.01,
+                        help="slowdown (s) below which a benchmark is not reported, against timer noise")
+    parser.add_argument("--no-record", action="store_true", help="do not append this run to the history")
+    args = parser.parse_args()
+
+    results = {}
+    regressions = 0
+    print("\t".join(["benchmark"] + phases + ["total", "previous", "comb", "sync", "signals", "specials", "lines"]))
+    for name in args.benchmarks:
+        runs = [run(name) for i in range(args.repeat)]
+        times = {phase: min(t[phase] for t, s in runs) for phase in phases}
+        sizes = runs[0][1]
+        total = sum(times.values())
+        results[name] = dict(times, total=total, **sizes)
+
+        previous = _last(args.history, name)
+        if previous is None:
+            comparison = "-"
+        else:
+            ratio = total/previous["total"]
+            comparison = "{:.3f} ({:+.0f}%)".format(previous["total"], 100*(ratio - 1))
+            if ratio > args.threshold and total - previous["total"] > args.min_delta:
+                comparison += " REGRESSION"
+                regressions += 1
+        print("\t".join([name] + ["{:.3f}".format(times[phase]) for phase in phases] +
+                        ["{:.3f}".format(total), comparison] +
+                        [str(sizes[k]) for k in ["comb", "sync", "signals", "specials", "lines"]]), flush=True)
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+        with open(args.history, "a") as f:
+            f.write(json.dumps({
+                "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "revision": _revision(),
+                "python": sys.version.split()[0],
+                "repeat": args.repeat,
+                "results": results
+            }, sort_keys=True) + "\n")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Loopback bit error rate test of the prbs SoC (hdmi_design.py --prbs, hdmi out
+# cabled to hdmi in) through litex_server, e.g.:
+#   litex_server uart /dev/ttyUSB1 115200 &
+#   ./ber_sweep.py --window 24 > eye.tsv
+import argparse
+import time
+
+from litex.soc.tools.remote import RemoteClient
+
+
+ntaps = 32
+tap_delay = 1/(32*2*200e6) # IDELAYE2 tap with a 200MHz reference
+# the self synchronizing checker counts every bit error 3 times
+error_weight = 3
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HDMI loopback bit error rate and eye margin")
+    parser.add_argument("--csr-csv", default="build/csr.csv")
+    parser.add_argument("--port", type=int, default=1234, help="litex_server port")
+    parser.add_argument("--window", type=int, default=20, help="pix cycles per tap (log2)")
+    parser.add_argument("--tap", type=int, default=None, help="measure at a fixed tap instead of sweeping")
+    parser.add_argument("--duration", type=float, default=10, help="fixed tap measurement time (s)")
+    args = parser.parse_args()
+
+    wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+    wb.open()
+    regs = wb.regs
+    pix_clock = regs.link_pix_clock.read()*1e3
+    if not pix_clock:
+        print("no input clock, check the loopback cable")
+        wb.close()
+        return
+    nlanes = len([name for name in dir(regs) if name.startswith("ber_lane")])
+
+    if args.tap is not None:
+        regs.ber_tap.write(args.tap)
+        regs.ber_enable.write(1)
+        regs.ber_clear.write(1)
+        time.sleep(args.duration)
+        regs.ber_update.write(1)
+        bits = 10*regs.ber_cycles.read()
+        for lane in range(nlanes):
+            errors = getattr(regs, "ber_lane{}_errors".format(lane)).read()/error_weight
+            print("lane {}: tap {}, {:.0f} bit errors in {:.3e} bits, ber {}".format(
+                lane, args.tap, errors, bits,
+                "{:.2e}".format(errors/bits) if errors else "< {:.2e}".format(1/bits)))
+        regs.ber_enable.write(0)
+        wb.close()
+        return
+
+    # margin map: errors at every tap, the eye is the longest error free run
+    regs.ber_sweep_window.write(args.window)
+    regs.ber_sweep_start.write(1)
+    time.sleep(ntaps*2**args.window/pix_clock)
+    while not regs.ber_sweep_done.read():
+        time.sleep(0.1)
+
+    bits = 10*2**args.window
+    print("tap\tdelay_ps\t" + "\t".join("lane{}_ber".format(lane) for lane in range(nlanes)))
+    margin_map = []
+    for lane in range(nlanes):
+        regs.ber_sweep_lane.write(lane)
+        errors = []
+        for tap in range(ntaps):
+            regs.ber_sweep_tap.write(tap)
+            errors.append(regs.ber_sweep_errors.read()/error_weight)
+        margin_map.append(errors)
+    for tap in range(ntaps):
+        print("{}\t{:.0f}\t".format(tap, tap*tap_delay*1e12) + "\t".join(
+            "{:.2e}".format(margin_map[lane][tap]/bits) for lane in range(nlanes)))
+
+    ui = 1/(10*pix_clock)
+    for lane, errors in enumerate(margin_map):
+        best = (0, 0)
+        run = 0
+        for tap, e in enumerate(errors):
+            run = run + 1 if e == 0 else 0
+            if run > best[0]:
+                best = (run, tap - run + 1)
+        print("# lane {}: eye {} taps ({:.0f} ps, {:.2f} UI) from tap {}, center tap {}".format(
+            lane, best[0], best[0]*tap_delay*1e12, best[0]*tap_delay/ui, best[1], best[1] + best[0]//2))
+
+    wb.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# Content addressed cache of the Vivado builds: the bitstream of a build is
+# keyed on the generated sources (Verilog, constraints, Vivado script, and so
+# the toolchain options) and on the Vivado installation, and restored instead
+# of rebuilding when the key is already in the cache.
+import hashlib
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import time
+
+
+def _files(build_dir, build_name):
+    # the vivado script, everything it reads, and the memory contents the
+    # verilog loads from data files written next to it ($readmemh)
+    tcl = os.path.join(build_dir, build_name + ".tcl")
+    files = [tcl]
+    with open(tcl) as f:
+        for line in f:
+            m = re.match(r"(?:add_files|read_xdc|read_edif|read_ip) \{?([^}\s]+)\}?", line)
+            if m:
+                files.append(os.path.join(build_dir, m.group(1)))
+    for filename in list(files):
+        if filename.endswith(".v"):
+            with open(filename) as f:
+                for data in sorted(set(re.findall(r"\$readmem[hb]\(\"([^\"]+)\"", f.read()))):
+                    files.append(os.path.join(build_dir, data))
+    return files
+
+
+def vivado_settings(toolchain_path="/opt/Xilinx/Vivado"):
+    # settings script of the latest Vivado installed in toolchain_path, that
+    # the LiteX build script sources before running vivado, None if there is
+    # none (vivado must then be in the PATH)
+    try:
+        versions = sorted(os.listdir(toolchain_path), key=lambda v: [int(n) for n in re.findall(r"\d+", v)])
+    except OSError:
+        return None
+    for version in reversed(versions):
+        for name in ["settings64.sh", "settings32.sh"]:
+            settings = os.path.join(toolchain_path, version, name)
+            if os.path.exists(settings):
+                return settings
+    return None
+
+
+def source_hash(build_dir, build_name="top", settings=None):
+    h = hashlib.sha256()
+    h.update(os.environ.get("XILINX_VIVADO", "").encode())
+    h.update((settings or "").encode())
+    for filename in _files(build_dir, build_name):
+        h.update(os.path.basename(filename).encode())
+        with open(filename, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def _timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(t))
+
+
+def _seconds(hms):
+    h, m, s = (int(v) for v in hms.split(":"))
+    return 3600*h + 60*m + s
+
+
+def vivado_phases(log):
+    # "route_design: Time (s): cpu = 00:01:02 ; elapsed = 00:01:05 . Memory ..."
+    phases = {}
+    with open(log) as f:
+        for line in f:
+            m = re.match(r"(\w+): Time \(s\): cpu = ([\d:]+) ; elapsed = ([\d:]+)", line)
+            if m:
+                phases[m.group(1)] = phases.get(m.group(1), 0) + _seconds(m.group(3))
+    return phases
+
+
+def _reference(cache_dir, flow, build_name):
+    # routed checkpoint of the last build of the same flow
+    best = None
+    for key in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, key)
+        try:
+            with open(os.path.join(entry, "report.json")) as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        dcp = os.path.join(entry, build_name + "_route.dcp")
+        if report.get("flow") == flow and os.path.exists(dcp):
+            if best is None or report["finished"] > best[0]:
+                best = (report["finished"], dcp)
+    return best[1] if best else None
+
+
+def cached_build(generate, build_dir, flow, output="build/top.bit", build_name="top",
+                 use_cache=True, incremental=False, phases=None, settings=None):
+    """Generate the sources (generate() runs the toolchain with run=False),
+    then build them with Vivado (after sourcing settings, if given) unless
+    the cache has them, and copy the bitstream to output. Returns the report
+    of the build."""
+    started = time.time()
+    phases = dict(phases or {})
+    generate()
+    phases["generate"] = time.time() - started
+
+    key = source_hash(build_dir, build_name, settings)
+    cache_dir = os.path.join(os.path.dirname(output) or ".", "cache")
+    entry = os.path.join(cache_dir, key)
+    bitstream = os.path.join(entry, build_name + ".bit")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    hit = use_cache and os.path.exists(bitstream)
+    if hit:
+        with open(os.path.join(entry, "report.json")) as f:
+            report = json.load(f)
+    else:
+        tcl = os.path.join(build_dir, build_name + ".tcl")
+        reference = _reference(cache_dir, flow, build_name) if incremental else None
+        if reference is not None:
+            # vivado incremental place and route from the last routed design
+            with open(tcl) as f:
+                script = f.read()
+            script = script.replace("opt_design\n",
+                "opt_design\nread_checkpoint -incremental {{{}}}\n".format(os.path.abspath(reference)), 1)
+            with open(tcl, "w") as f:
+                f.write(script)
+
+        vivado_started = time.time()
+        command = "vivado -mode batch -source " + shlex.quote(build_name + ".tcl")
+        if settings is not None:
+            command = "source " + shlex.quote(settings) + " && " + command
+        subprocess.check_call(["bash", "-c", command], cwd=build_dir)
+        phases["vivado"] = time.time() - vivado_started
+        phases.update(("vivado_" + k, v) for k, v in vivado_phases(os.path.join(build_dir, "vivado.log")).items())
+
+        os.makedirs(entry, exist_ok=True)
+        for suffix in [".bit", "_route.dcp", "_timing.rpt", "_utilization_place.rpt"]:
+            filename = os.path.join(build_dir, build_name + suffix)
+            if os.path.exists(filename):
+                shutil.copy(filename, entry)
+        report = {
+            "hash": key,
+            "flow": flow,
+            "incremental": reference,
+            "started": _timestamp(started),
+            "finished": _timestamp(time.time()),
+            "phases": phases
+        }
+        with open(os.path.join(entry, "report.json"), "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    shutil.copy(bitstream, output)
+    with open(os.path.join(cache_dir, "builds.log"), "a") as f:
+        f.write("{}\t{}\t{}\t{}\t{}\n".format(_timestamp(started), flow, key[:16], "hit" if hit else "miss",
+            " ".join("{}={:.1f}".format(k, v) for k, v in sorted(phases.items()))))
+    return dict(report, hit=hit, phases=phases)
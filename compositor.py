@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# Software model of the compositor (Compositor with a LineBufferLayer
+# background and an InsetLayer in hdmi_design.py) and check of the hardware
+# against it: an inset input slower than, faster than and as fast as the
+# output pixel clock, with alpha blending and keying, and with the inset
+# frames starting right next to the output frame start, where the inset
+# buffers are handed over between the two clock domains.
+import argparse
+
+import numpy as np
+
+import tmds
+
+
+# small mode to keep simulations short, the inset input uses it too
+check_timing = tmds.VideoTiming(None,
+    16, 18, 20, 24,
+    12, 13, 14, 16,
+    1, 1)
+
+
+def downscale(frame, width, height, scale):
+    """Inset buffer contents of an input frame: one pixel out of scale in both
+    directions from the first active one, cropped to width x height."""
+    return np.asarray(frame)[::scale, ::scale][:height, :width]
+
+
+def blend(below, inset, alpha=256, key=None):
+    """inset over below, (alpha*inset + (256 - alpha)*below)/256 per channel,
+    except where inset is the key color (r, g, b) when one is given."""
+    below = np.asarray(below, dtype=np.int32)
+    inset = np.asarray(inset, dtype=np.int32)
+    out = (inset*alpha + below*(256 - alpha)) >> 8
+    if key is not None:
+        keyed = (inset == np.asarray(key)).all(axis=-1)
+        out[keyed] = below[keyed]
+    return out.astype(np.uint8)
+
+
+def composite(background, inset=None, x=0, y=0, alpha=256, key=None):
+    """Output frame of a background frame and the (downscaled) inset buffer
+    shown at x, y, None when no inset frame is ready yet."""
+    out = np.array(background, dtype=np.uint8)
+    if inset is not None:
+        h, w = inset.shape[:2]
+        region = out[y:y+h, x:x+w]
+        out[y:y+h, x:x+w] = blend(region, inset[:region.shape[0], :region.shape[1]], alpha, key)
+    return out
+
+
+def random_frames(nframes, width, height, seed=0):
+    rng = np.random.RandomState(seed)
+    return [rng.randint(0, 256, (height, width, 3)).astype(np.uint8) for i in range(nframes)]
+
+
+def simulate(background, inset, period, offset=0, inset_width=8, inset_height=6, scale=2, x=5, y=3,
+             alpha=256, key=None, timing=check_timing):
+    # runs the background frames into a LineBufferLayer in pix (period 10) and
+    # the inset frames into an InsetLayer in a domain of the given period,
+    # starting offset inset cycles later, and returns the output frames
+    from litex.gen import Module, Record, run_simulation
+    from hdmi_design import Compositor, LineBufferLayer, InsetLayer, pixel_layout
+
+    class Top(Module):
+        def __init__(self):
+            self.background = Record(pixel_layout)
+            self.inset = Record(pixel_layout)
+
+            # registered like the inputs of a design
+            background = Record(pixel_layout)
+            inset = Record(pixel_layout)
+            self.sync.pix += background.eq(self.background)
+            self.sync.inset += inset.eq(self.inset)
+
+            layer = InsetLayer(inset, "inset", inset_width, inset_height, scale, x=x, y=y)
+            layer._alpha.storage.reset = alpha
+            if key is not None:
+                layer._key_enable.storage.reset = 1
+                layer._key.storage.reset = key[0] | (key[1] << 8) | (key[2] << 16)
+            self.submodules.compositor = Compositor(
+                LineBufferLayer(background, "pix", width=timing.hactive, nlines=4), [layer], timing)
+
+    top = Top()
+    output = []
+    ncycles = len(background)*timing.hscan*timing.vscan
+    run_simulation(top, {
+            "pix": [_source(top.background, background, timing), _sink(top.compositor.source, ncycles, output)],
+            "inset": _source(top.inset, inset, timing, offset)
+        }, clocks={"sys": 10, "pix": 10, "inset": period})
+    return [np.array(frame, dtype=np.uint8) for frame in output
+            if len(frame) == timing.vactive and all(len(line) == timing.hactive for line in frame)]
+
+
+# frames back to back, each one from its first active line
+def _source(pixels, frames, timing, offset=0):
+    for i in range(offset):
+        yield
+    yield pixels.valid.eq(1)
+    for frame in frames:
+        for y in range(timing.vscan):
+            for x in range(timing.hscan):
+                de = x < timing.hactive and y < timing.vactive
+                yield pixels.de.eq(de)
+                yield pixels.hsync.eq(timing.hsync_start <= x < timing.hsync_end)
+                yield pixels.vsync.eq(timing.vsync_start <= y < timing.vsync_end)
+                if de:
+                    r, g, b = (int(v) for v in frame[y][x])
+                    yield pixels.r.eq(r)
+                    yield pixels.g.eq(g)
+                    yield pixels.b.eq(b)
+                yield
+
+
+# active pixels of the output, one list of lines per frame (split at vsync)
+def _sink(pixels, ncycles, frames):
+    last_de = 0
+    lines = []
+    for cycle in range(ncycles):
+        de = yield pixels.de
+        if de:
+            if not last_de:
+                lines.append([])
+            lines[-1].append(((yield pixels.r), (yield pixels.g), (yield pixels.b)))
+        if (yield pixels.vsync) and lines:
+            frames.append(lines)
+            lines = []
+        last_de = de
+        yield
+
+
+def match(frame, background, inset, inset_width=8, inset_height=6, scale=2, x=0, y=0, alpha=256, key=None):
+    """(background index, inset index or None) of the model output equal to
+    frame, None when there is none (e.g. a torn inset)."""
+    for i, bg in enumerate(background):
+        for j, fg in [(None, None)] + list(enumerate(inset)):
+            if fg is not None:
+                fg = downscale(fg, inset_width, inset_height, scale)
+            if np.array_equal(frame, composite(bg, fg, x, y, alpha, key)):
+                return i, j
+    return None
+
+
+def check(period, nframes=10, offset=0, alpha=256, key=None, seed=0, x=5, y=3):
+    # hardware against the model, returns the frames that match no model
+    # output and the (background, inset) frame pairs of the others. the
+    # first two output frames (genlock) are not checked.
+    timing = check_timing
+    background = random_frames(nframes, timing.hactive, timing.vactive, seed)
+    ninsets = (nframes*10)//period + 2
+    inset = random_frames(ninsets, timing.hactive, timing.vactive, seed + 1)
+    if key is not None:
+        # some keyed pixels in every inset frame
+        for frame in inset:
+            frame[::4, ::4] = key
+    output = simulate(background, inset, period, offset, x=x, y=y, alpha=alpha, key=key)
+    errors = 0
+    shown = []
+    for frame in output[2:]:
+        pair = match(frame, background, inset, x=x, y=y, alpha=alpha, key=key)
+        if pair is None:
+            errors += 1
+        else:
+            shown.append(pair)
+    return errors, shown
+
+
+def consistent(shown, period):
+    # backgrounds follow each other, once shown an inset stays, never goes
+    # back, moves on every frame with the input at least as fast as the
+    # output and, with a slower one, shows every input frame
+    backgrounds = [b for b, i in shown]
+    insets = [i for b, i in shown]
+    if any(b1 != b0 + 1 for b0, b1 in zip(backgrounds, backgrounds[1:])):
+        return False
+    first = next((n for n, i in enumerate(insets) if i is not None), None)
+    if first is None:
+        return False
+    insets = insets[first:]
+    if None in insets or any(i1 < i0 for i0, i1 in zip(insets, insets[1:])):
+        return False
+    if period <= 10:
+        return all(i1 > i0 for i0, i1 in zip(insets, insets[1:]))
+    return all(i1 - i0 <= 1 for i0, i1 in zip(insets, insets[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compositor model and check")
+    parser.add_argument("--frames", type=int, default=10, help="background frames per simulation")
+    parser.add_argument("--handover-offsets", type=int, default=16,
+                        help="inset frame starts checked on each side of the buffer handover")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    failures = 0
+    # (inset clock period against 10 for pix, alpha, key)
+    cases = [
+        (14, 256, None),
+        (7, 256, None),
+        (10, 256, None),
+        (14, 96, None),
+        (7, 256, (0x12, 0x34, 0x56)),
+        (10, 160, (0x12, 0x34, 0x56))
+    ]
+    for period, alpha, key in cases:
+        errors, shown = check(period, args.frames, alpha=alpha, key=key, seed=args.seed)
+        ok = not errors and consistent(shown, period)
+        failures += not ok
+        print("inset period {} (pix 10), alpha {}, key {}: {} frames, {} errors, inset frames shown {}{}".format(
+            period, alpha, "-" if key is None else "#{:02x}{:02x}{:02x}".format(*key),
+            errors + len(shown), errors, [i for b, i in shown], "" if ok else " FAILED"))
+
+    # buffer handover: with the same clock the inset frames keep their place
+    # against the output frames. the output frame starts one line before its
+    # first active line and the inset frames at theirs, so with an offset of
+    # one line both start together (give or take the pipeline latencies),
+    # which is where the buffer is requested and granted.
+    failed_offsets = []
+    for offset in range(check_timing.hscan - args.handover_offsets, check_timing.hscan + args.handover_offsets + 1):
+        errors, shown = check(10, 6, offset, seed=args.seed)
+        if errors or not consistent(shown, 10):
+            failed_offsets.append(offset)
+    failures += len(failed_offsets)
+    print("buffer handover: {} inset frame offsets, {} failed {}".format(
+        2*args.handover_offsets + 1, len(failed_offsets), failed_offsets))
+    assert not failures
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,45 @@
 #!/usr/bin/env python3
 import argparse
 import os
+import time
+from functools import reduce
+from operator import or_, add, xor
 
 from litex.gen import *
 from litex.gen.genlib.resetsync import AsyncResetSynchronizer
+from litex.gen.genlib.cdc import MultiReg, GrayCounter, PulseSynchronizer
 from litex.gen.fhdl.specials import Tristate
 from litex.gen.genlib.misc import WaitTimer
+from litex.gen.genlib.fsm import FSM, NextState, NextValue
+from litex.gen.genlib.fifo import AsyncFIFO
 
 from litex.boards.platforms import nexys_video
 
+from litex.soc.interconnect.csr import *
+from litex.soc.integration.soc_sdram import *
 from litex.soc.integration.builder import *
+from litex.soc.cores.uart import UARTWishboneBridge
+
+from litedram.modules import MT41K256M16
+from litedram.phy import a7ddrphy
+from litedram.frontend.dma import LiteDRAMDMAWriter
 
 from litevideo.input.edid import EDID
+from litevideo.input.common import control_tokens, channel_layout
 from litevideo.input.decoding import Decoding
 
 from litevideo.output.hdmi.s7 import S7HDMIOutPHY, S7HDMIOutEncoderSerializer
 
+import colorspace
+import tmds
+from build_cache import cached_build, vivado_settings
+
 
 class _CRG(Module):
     def __init__(self, platform):
         self.clock_domains.cd_sys = ClockDomain()
+        self.clock_domains.cd_sys4x = ClockDomain(reset_less=True)
+        self.clock_domains.cd_sys4x_dqs = ClockDomain(reset_less=True)
         self.clock_domains.cd_clk200 = ClockDomain()
 
         clk100 = platform.request("clk100")
@@ -28,6 +48,8 @@ class _CRG(Module):
         pll_locked = Signal()
         pll_fb = Signal()
         pll_sys = Signal()
+        pll_sys4x = Signal()
+        pll_sys4x_dqs = Signal()
         pll_clk200 = Signal()
         self.specials += [
             Instance("PLLE2_BASE",
@@ -42,11 +64,21 @@ class _CRG(Module):
                      p_CLKOUT0_DIVIDE=8, p_CLKOUT0_PHASE=0.0,
                      o_CLKOUT0=pll_sys,
 
+                     # 400 MHz
+                     p_CLKOUT1_DIVIDE=2, p_CLKOUT1_PHASE=0.0,
+                     o_CLKOUT1=pll_sys4x,
+
+                     # 400 MHz dqs
+                     p_CLKOUT2_DIVIDE=2, p_CLKOUT2_PHASE=90.0,
+                     o_CLKOUT2=pll_sys4x_dqs,
+
                      # 200 MHz
                      p_CLKOUT3_DIVIDE=4, p_CLKOUT3_PHASE=0.0,
                      o_CLKOUT3=pll_clk200
             ),
             Instance("BUFG", i_I=pll_sys, o_O=self.cd_sys.clk),
+            Instance("BUFG", i_I=pll_sys4x, o_O=self.cd_sys4x.clk),
+            Instance("BUFG", i_I=pll_sys4x_dqs, o_O=self.cd_sys4x_dqs.clk),
             Instance("BUFG", i_I=pll_clk200, o_O=self.cd_clk200.clk),
             AsyncResetSynchronizer(self.cd_sys, ~pll_locked | ~rst),
             AsyncResetSynchronizer(self.cd_clk200, ~pll_locked | rst),
@@ -63,181 +95,512 @@ class _CRG(Module):
         self.specials += Instance("IDELAYCTRL", i_REFCLK=ClockSignal("clk200"), i_RST=ic_reset)
 
 
+# TMDS data and control symbols, bit 0 first on the wire
+valid_symbols = [
+    0b1111111111, 0b0100000000, 0b0111111111, 0b1100000000,
+    0b0111111110, 0b1100000001, 0b1111111110, 0b0100000001,
+    0b0111111100, 0b1100000011, 0b1111111100, 0b0100000011,
+    0b1111111101, 0b0100000010, 0b0111111101, 0b1100000010,
+    0b0111111000, 0b1100000111, 0b1111111000, 0b0100000111,
+    0b1111111001, 0b0100000110, 0b0111111001, 0b1100000110,
+    0b1111111011, 0b0100000100, 0b0111111011, 0b1100000100,
+    0b0111111010, 0b1100000101, 0b1111111010, 0b0100000101,
+    0b0111110000, 0b0100001111, 0b1111110001, 0b0100001110,
+    0b0111110001, 0b1100001110, 0b1111110011, 0b0100001100,
+    0b0111110011, 0b1100001100, 0b0111110010, 0b1100001101,
+    0b1111110010, 0b0100001101, 0b1111110111, 0b0100001000,
+    0b0111110111, 0b1100001000, 0b0111110110, 0b1100001001,
+    0b1111110110, 0b0100001001, 0b0111110100, 0b1100001011,
+    0b1111110100, 0b0100001011, 0b1001011111, 0b0010100000,
+    0b0001011111, 0b1010100000, 0b1100011111, 0b0111100000,
+    0b0100011111, 0b1111100000, 0b0100011110, 0b0111100001,
+    0b1111100011, 0b0100011100, 0b0111100011, 0b1100011100,
+    0b0111100010, 0b0100011101, 0b1111100111, 0b0100011000,
+    0b0111100111, 0b1100011000, 0b0111100110, 0b1100011001,
+    0b1111100110, 0b0100011001, 0b0111100100, 0b0100011011,
+    0b1001001111, 0b0010110000, 0b0001001111, 0b1010110000,
+    0b1111101111, 0b0100010000, 0b0111101111, 0b1100010000,
+    0b0111101110, 0b1100010001, 0b1111101110, 0b0100010001,
+    0b0111101100, 0b1100010011, 0b1111101100, 0b0100010011,
+    0b1001000111, 0b1010111000, 0b0111101000, 0b0100010111,
+    0b0010111100, 0b1001000011, 0b1010111100, 0b0001000011,
+    0b0010111110, 0b1001000001, 0b1010111110, 0b0001000001,
+    0b1010111111, 0b0001000000, 0b0010111111, 0b1001000000,
+    0b1100111111, 0b0111000000, 0b0100111111, 0b1111000000,
+    0b0100111110, 0b1111000001, 0b1100111110, 0b0111000001,
+    0b0100111100, 0b0111000011, 0b1100111101, 0b0111000010,
+    0b0100111101, 0b1111000010, 0b1111000111, 0b0100111000,
+    0b0111000111, 0b1100111000, 0b0111000110, 0b0100111001,
+    0b1100111011, 0b0111000100, 0b0100111011, 0b1111000100,
+    0b1001101111, 0b0010010000, 0b0001101111, 0b1010010000,
+    0b1111001111, 0b0100110000, 0b0111001111, 0b1100110000,
+    0b0111001110, 0b1100110001, 0b1111001110, 0b0100110001,
+    0b0111001100, 0b0100110011, 0b1001100111, 0b0010011000,
+    0b0001100111, 0b1010011000, 0b1100110111, 0b0111001000,
+    0b0100110111, 0b1111001000, 0b1001100011, 0b1010011100,
+    0b0010011110, 0b1001100001, 0b1010011110, 0b0001100001,
+    0b1010011111, 0b0001100000, 0b0010011111, 0b1001100000,
+    0b1111011111, 0b0100100000, 0b0111011111, 0b1100100000,
+    0b0111011110, 0b1100100001, 0b1111011110, 0b0100100001,
+    0b0111011100, 0b1100100011, 0b1111011100, 0b0100100011,
+    0b1001110111, 0b0010001000, 0b0001110111, 0b1010001000,
+    0b0111011000, 0b0100100111, 0b1001110011, 0b0010001100,
+    0b0001110011, 0b1010001100, 0b1001110001, 0b1010001110,
+    0b1010001111, 0b0001110000, 0b0010001111, 0b1001110000,
+    0b1100101111, 0b0111010000, 0b0100101111, 0b1111010000,
+    0b1001111011, 0b0010000100, 0b0001111011, 0b1010000100,
+    0b1001111001, 0b0010000110, 0b0001111001, 0b1010000110,
+    0b1010000111, 0b1001111000, 0b1001111101, 0b0010000010,
+    0b0001111101, 0b1010000010, 0b0001111100, 0b1010000011,
+    0b1001111100, 0b0010000011, 0b0001111110, 0b1010000001,
+    0b1001111110, 0b0010000001, 0b1001111111, 0b0010000000,
+    0b0001111111, 0b1010000000, 0b1101111111, 0b0110000000,
+    0b0101111111, 0b1110000000, 0b0101111110, 0b1110000001,
+    0b1101111110, 0b0110000001, 0b0101111100, 0b1110000011,
+    0b1101111100, 0b0110000011, 0b1101111101, 0b0110000010,
+    0b0101111101, 0b1110000010, 0b0101111000, 0b0110000111,
+    0b1101111001, 0b0110000110, 0b0101111001, 0b1110000110,
+    0b1101111011, 0b0110000100, 0b0101111011, 0b1110000100,
+    0b1000101111, 0b0011010000, 0b0000101111, 0b1011010000,
+    0b1110001111, 0b0101110000, 0b0110001111, 0b1101110000,
+    0b0110001110, 0b0101110001, 0b1101110011, 0b0110001100,
+    0b0101110011, 0b1110001100, 0b1000100111, 0b1011011000,
+    0b1101110111, 0b0110001000, 0b0101110111, 0b1110001000,
+    0b0011011100, 0b1000100011, 0b1011011100, 0b0000100011,
+    0b0011011110, 0b1000100001, 0b1011011110, 0b0000100001,
+    0b1011011111, 0b0000100000, 0b0011011111, 0b1000100000,
+    0b1110011111, 0b0101100000, 0b0110011111, 0b1101100000,
+    0b0110011110, 0b1101100001, 0b1110011110, 0b0101100001,
+    0b0110011100, 0b0101100011, 0b1000110111, 0b0011001000,
+    0b0000110111, 0b1011001000, 0b1101100111, 0b0110011000,
+    0b0101100111, 0b1110011000, 0b1000110011, 0b1011001100,
+    0b0011001110, 0b1000110001, 0b1011001110, 0b0000110001,
+    0b1011001111, 0b0000110000, 0b0011001111, 0b1000110000,
+    0b1101101111, 0b0110010000, 0b0101101111, 0b1110010000,
+    0b1000111011, 0b0011000100, 0b0000111011, 0b1011000100,
+    0b1000111001, 0b1011000110, 0b1011000111, 0b0000111000,
+    0b0011000111, 0b1000111000, 0b1000111101, 0b0011000010,
+    0b0000111101, 0b1011000010, 0b1011000011, 0b1000111100,
+    0b0000111110, 0b1011000001, 0b1000111110, 0b0011000001,
+    0b1000111111, 0b0011000000, 0b0000111111, 0b1011000000,
+    0b1110111111, 0b0101000000, 0b0110111111, 0b1101000000,
+    0b0110111110, 0b1101000001, 0b1110111110, 0b0101000001,
+    0b0110111100, 0b1101000011, 0b1110111100, 0b0101000011,
+    0b1000010111, 0b1011101000, 0b0110111000, 0b0101000111,
+    0b0011101100, 0b1000010011, 0b1011101100, 0b0000010011,
+    0b0011101110, 0b1000010001, 0b1011101110, 0b0000010001,
+    0b1011101111, 0b0000010000, 0b0011101111, 0b1000010000,
+    0b1101001111, 0b0110110000, 0b0101001111, 0b1110110000,
+    0b1000011011, 0b1011100100, 0b0011100110, 0b1000011001,
+    0b1011100110, 0b0000011001, 0b1011100111, 0b0000011000,
+    0b0011100111, 0b1000011000, 0b1000011101, 0b1011100010,
+    0b1011100011, 0b0000011100, 0b0011100011, 0b1000011100,
+    0b1011100001, 0b1000011110, 0b1000011111, 0b0011100000,
+    0b0000011111, 0b1011100000, 0b1101011111, 0b0110100000,
+    0b0101011111, 0b1110100000, 0b0011110100, 0b1000001011,
+    0b1011110100, 0b0000001011, 0b0011110110, 0b1000001001,
+    0b1011110110, 0b0000001001, 0b1011110111, 0b0000001000,
+    0b0011110111, 0b1000001000, 0b0011110010, 0b1000001101,
+    0b1011110010, 0b0000001101, 0b1011110011, 0b0000001100,
+    0b0011110011, 0b1000001100, 0b1011110001, 0b0000001110,
+    0b0011110001, 0b1000001110, 0b1000001111, 0b1011110000,
+    0b0011111010, 0b1000000101, 0b1011111010, 0b0000000101,
+    0b1011111011, 0b0000000100, 0b0011111011, 0b1000000100,
+    0b1011111001, 0b0000000110, 0b0011111001, 0b1000000110,
+    0b0011111000, 0b1000000111, 0b1011111000, 0b0000000111,
+    0b1011111101, 0b0000000010, 0b0011111101, 0b1000000010,
+    0b0011111100, 0b1000000011, 0b1011111100, 0b0000000011,
+    0b0011111110, 0b1000000001, 0b1011111110, 0b0000000001,
+    0b1011111111, 0b0000000000, 0b0011111111, 0b1000000000,
+    0b0010101011, 0b0101010100, 0b1010101011, 0b1101010100]
+
+
 # TODO: to be removed when we'll have the phase detector working
 class InvalidSymbolDetector(Module):
-    def __init__(self, symbol):
+    def __init__(self, symbol, implementation="rom"):
         self.invalid = Signal()
+        self.latency = 0
 
         # # #
 
-        valid_symbols = [
-            0b1111111111, 0b0100000000, 0b0111111111, 0b1100000000,
-            0b0111111110, 0b1100000001, 0b1111111110, 0b0100000001,
-            0b0111111100, 0b1100000011, 0b1111111100, 0b0100000011,
-            0b1111111101, 0b0100000010, 0b0111111101, 0b1100000010,
-            0b0111111000, 0b1100000111, 0b1111111000, 0b0100000111,
-            0b1111111001, 0b0100000110, 0b0111111001, 0b1100000110,
-            0b1111111011, 0b0100000100, 0b0111111011, 0b1100000100,
-            0b0111111010, 0b1100000101, 0b1111111010, 0b0100000101,
-            0b0111110000, 0b0100001111, 0b1111110001, 0b0100001110,
-            0b0111110001, 0b1100001110, 0b1111110011, 0b0100001100,
-            0b0111110011, 0b1100001100, 0b0111110010, 0b1100001101,
-            0b1111110010, 0b0100001101, 0b1111110111, 0b0100001000,
-            0b0111110111, 0b1100001000, 0b0111110110, 0b1100001001,
-            0b1111110110, 0b0100001001, 0b0111110100, 0b1100001011,
-            0b1111110100, 0b0100001011, 0b1001011111, 0b0010100000,
-            0b0001011111, 0b1010100000, 0b1100011111, 0b0111100000,
-            0b0100011111, 0b1111100000, 0b0100011110, 0b0111100001,
-            0b1111100011, 0b0100011100, 0b0111100011, 0b1100011100,
-            0b0111100010, 0b0100011101, 0b1111100111, 0b0100011000,
-            0b0111100111, 0b1100011000, 0b0111100110, 0b1100011001,
-            0b1111100110, 0b0100011001, 0b0111100100, 0b0100011011,
-            0b1001001111, 0b0010110000, 0b0001001111, 0b1010110000,
-            0b1111101111, 0b0100010000, 0b0111101111, 0b1100010000,
-            0b0111101110, 0b1100010001, 0b1111101110, 0b0100010001,
-            0b0111101100, 0b1100010011, 0b1111101100, 0b0100010011,
-            0b1001000111, 0b1010111000, 0b0111101000, 0b0100010111,
-            0b0010111100, 0b1001000011, 0b1010111100, 0b0001000011,
-            0b0010111110, 0b1001000001, 0b1010111110, 0b0001000001,
-            0b1010111111, 0b0001000000, 0b0010111111, 0b1001000000,
-            0b1100111111, 0b0111000000, 0b0100111111, 0b1111000000,
-            0b0100111110, 0b1111000001, 0b1100111110, 0b0111000001,
-            0b0100111100, 0b0111000011, 0b1100111101, 0b0111000010,
-            0b0100111101, 0b1111000010, 0b1111000111, 0b0100111000,
-            0b0111000111, 0b1100111000, 0b0111000110, 0b0100111001,
-            0b1100111011, 0b0111000100, 0b0100111011, 0b1111000100,
-            0b1001101111, 0b0010010000, 0b0001101111, 0b1010010000,
-            0b1111001111, 0b0100110000, 0b0111001111, 0b1100110000,
-            0b0111001110, 0b1100110001, 0b1111001110, 0b0100110001,
-            0b0111001100, 0b0100110011, 0b1001100111, 0b0010011000,
-            0b0001100111, 0b1010011000, 0b1100110111, 0b0111001000,
-            0b0100110111, 0b1111001000, 0b1001100011, 0b1010011100,
-            0b0010011110, 0b1001100001, 0b1010011110, 0b0001100001,
-            0b1010011111, 0b0001100000, 0b0010011111, 0b1001100000,
-            0b1111011111, 0b0100100000, 0b0111011111, 0b1100100000,
-            0b0111011110, 0b1100100001, 0b1111011110, 0b0100100001,
-            0b0111011100, 0b1100100011, 0b1111011100, 0b0100100011,
-            0b1001110111, 0b0010001000, 0b0001110111, 0b1010001000,
-            0b0111011000, 0b0100100111, 0b1001110011, 0b0010001100,
-            0b0001110011, 0b1010001100, 0b1001110001, 0b1010001110,
-            0b1010001111, 0b0001110000, 0b0010001111, 0b1001110000,
-            0b1100101111, 0b0111010000, 0b0100101111, 0b1111010000,
-            0b1001111011, 0b0010000100, 0b0001111011, 0b1010000100,
-            0b1001111001, 0b0010000110, 0b0001111001, 0b1010000110,
-            0b1010000111, 0b1001111000, 0b1001111101, 0b0010000010,
-            0b0001111101, 0b1010000010, 0b0001111100, 0b1010000011,
-            0b1001111100, 0b0010000011, 0b0001111110, 0b1010000001,
-            0b1001111110, 0b0010000001, 0b1001111111, 0b0010000000,
-            0b0001111111, 0b1010000000, 0b1101111111, 0b0110000000,
-            0b0101111111, 0b1110000000, 0b0101111110, 0b1110000001,
-            0b1101111110, 0b0110000001, 0b0101111100, 0b1110000011,
-            0b1101111100, 0b0110000011, 0b1101111101, 0b0110000010,
-            0b0101111101, 0b1110000010, 0b0101111000, 0b0110000111,
-            0b1101111001, 0b0110000110, 0b0101111001, 0b1110000110,
-            0b1101111011, 0b0110000100, 0b0101111011, 0b1110000100,
-            0b1000101111, 0b0011010000, 0b0000101111, 0b1011010000,
-            0b1110001111, 0b0101110000, 0b0110001111, 0b1101110000,
-            0b0110001110, 0b0101110001, 0b1101110011, 0b0110001100,
-            0b0101110011, 0b1110001100, 0b1000100111, 0b1011011000,
-            0b1101110111, 0b0110001000, 0b0101110111, 0b1110001000,
-            0b0011011100, 0b1000100011, 0b1011011100, 0b0000100011,
-            0b0011011110, 0b1000100001, 0b1011011110, 0b0000100001,
-            0b1011011111, 0b0000100000, 0b0011011111, 0b1000100000,
-            0b1110011111, 0b0101100000, 0b0110011111, 0b1101100000,
-            0b0110011110, 0b1101100001, 0b1110011110, 0b0101100001,
-            0b0110011100, 0b0101100011, 0b1000110111, 0b0011001000,
-            0b0000110111, 0b1011001000, 0b1101100111, 0b0110011000,
-            0b0101100111, 0b1110011000, 0b1000110011, 0b1011001100,
-            0b0011001110, 0b1000110001, 0b1011001110, 0b0000110001,
-            0b1011001111, 0b0000110000, 0b0011001111, 0b1000110000,
-            0b1101101111, 0b0110010000, 0b0101101111, 0b1110010000,
-            0b1000111011, 0b0011000100, 0b0000111011, 0b1011000100,
-            0b1000111001, 0b1011000110, 0b1011000111, 0b0000111000,
-            0b0011000111, 0b1000111000, 0b1000111101, 0b0011000010,
-            0b0000111101, 0b1011000010, 0b1011000011, 0b1000111100,
-            0b0000111110, 0b1011000001, 0b1000111110, 0b0011000001,
-            0b1000111111, 0b0011000000, 0b0000111111, 0b1011000000,
-            0b1110111111, 0b0101000000, 0b0110111111, 0b1101000000,
-            0b0110111110, 0b1101000001, 0b1110111110, 0b0101000001,
-            0b0110111100, 0b1101000011, 0b1110111100, 0b0101000011,
-            0b1000010111, 0b1011101000, 0b0110111000, 0b0101000111,
-            0b0011101100, 0b1000010011, 0b1011101100, 0b0000010011,
-            0b0011101110, 0b1000010001, 0b1011101110, 0b0000010001,
-            0b1011101111, 0b0000010000, 0b0011101111, 0b1000010000,
-            0b1101001111, 0b0110110000, 0b0101001111, 0b1110110000,
-            0b1000011011, 0b1011100100, 0b0011100110, 0b1000011001,
-            0b1011100110, 0b0000011001, 0b1011100111, 0b0000011000,
-            0b0011100111, 0b1000011000, 0b1000011101, 0b1011100010,
-            0b1011100011, 0b0000011100, 0b0011100011, 0b1000011100,
-            0b1011100001, 0b1000011110, 0b1000011111, 0b0011100000,
-            0b0000011111, 0b1011100000, 0b1101011111, 0b0110100000,
-            0b0101011111, 0b1110100000, 0b0011110100, 0b1000001011,
-            0b1011110100, 0b0000001011, 0b0011110110, 0b1000001001,
-            0b1011110110, 0b0000001001, 0b1011110111, 0b0000001000,
-            0b0011110111, 0b1000001000, 0b0011110010, 0b1000001101,
-            0b1011110010, 0b0000001101, 0b1011110011, 0b0000001100,
-            0b0011110011, 0b1000001100, 0b1011110001, 0b0000001110,
-            0b0011110001, 0b1000001110, 0b1000001111, 0b1011110000,
-            0b0011111010, 0b1000000101, 0b1011111010, 0b0000000101,
-            0b1011111011, 0b0000000100, 0b0011111011, 0b1000000100,
-            0b1011111001, 0b0000000110, 0b0011111001, 0b1000000110,
-            0b0011111000, 0b1000000111, 0b1011111000, 0b0000000111,
-            0b1011111101, 0b0000000010, 0b0011111101, 0b1000000010,
-            0b0011111100, 0b1000000011, 0b1011111100, 0b0000000011,
-            0b0011111110, 0b1000000001, 0b1011111110, 0b0000000001,
-            0b1011111111, 0b0000000000, 0b0011111111, 0b1000000000,
-            0b0010101011, 0b0101010100, 0b1010101011, 0b1101010100]
-
-        self.comb += self.invalid.eq(1)
-        for s in valid_symbols:
-            self.comb += If(symbol == s, self.invalid.eq(0))
+        if implementation == "compare":
+            self.comb += self.invalid.eq(1)
+            for s in valid_symbols:
+                self.comb += If(symbol == s, self.invalid.eq(0))
+        elif implementation == "rom":
+            # 1024x1 lookup, maps to a distributed rom
+            valid = set(valid_symbols)
+            rom = Memory(1, 1024, init=[int(s not in valid) for s in range(1024)])
+            rom_port = rom.get_port(async_read=True, clock_domain="pix")
+            self.specials += rom, rom_port
+            self.comb += [
+                rom_port.adr.eq(symbol),
+                self.invalid.eq(rom_port.dat_r)
+            ]
+        elif implementation == "arithmetic":
+            # pipelined check of the encoder decisions (xor/xnor, dc balance)
+            self.latency = 3
+
+            # stage 1: undo inversion and transition minimization
+            q_m = Signal(8)
+            d = Signal(8)
+            xor = Signal()
+            inverted = Signal()
+            control = Signal()
+            self.sync.pix += [
+                q_m.eq(symbol[:8] ^ Replicate(symbol[9], 8)),
+                d[0].eq(symbol[0] ^ symbol[9]),
+                xor.eq(symbol[8]),
+                inverted.eq(symbol[9]),
+                control.eq(reduce(or_, [symbol == t for t in control_tokens]))
+            ]
+            for i in range(1, 8):
+                self.sync.pix += d[i].eq(symbol[i] ^ symbol[i-1] ^ ~symbol[8])
+
+            # stage 2: count ones
+            n1_d = Signal(4)
+            n1_q_m = Signal(4)
+            d0 = Signal()
+            xor_r = Signal()
+            inverted_r = Signal()
+            control_r = Signal()
+            self.sync.pix += [
+                n1_d.eq(reduce(add, [d[i] for i in range(8)])),
+                n1_q_m.eq(reduce(add, [q_m[i] for i in range(8)])),
+                d0.eq(d[0]),
+                xor_r.eq(xor),
+                inverted_r.eq(inverted),
+                control_r.eq(control)
+            ]
+
+            # stage 3: check encoder decisions
+            xnor_expected = Signal()
+            self.comb += xnor_expected.eq((n1_d > 4) | ((n1_d == 4) & ~d0))
+            self.sync.pix += self.invalid.eq(~control_r & (
+                (xor_r == xnor_expected) |
+                ((n1_q_m == 4) & (inverted_r == xor_r))))
+        else:
+            raise ValueError("Unknown implementation: " + implementation)
 
 
 class AlignmentDetector(Module):
-    def __init__(self, invalid_symbol):
+    def __init__(self, invalid_symbols, delay_search=True, window=10,
+                 holdoff_bits=10, restart_quality=0xf, lock_quality=0x4, error_increment=0x100000):
+        self.restart = Signal()
+
         self.delay_count = Signal(5)
-        self.delay_ce = Signal()
-        self.bitslip = Signal()
+        self.word_offset = Signal(max=len(invalid_symbols))
+
+        self.locked = Signal()
+        self.lock_cycles = Signal(32)
+        self.seeded = Signal()
+        self.symbol_error = Signal()
+        self.signal_quality = Signal(4)
 
         # # #
 
-        count = Signal(20)
+        noffsets = len(invalid_symbols)
+        invalid_symbol = Array(invalid_symbols[i] for i in range(noffsets))[self.word_offset]
+
+        # search: measure every word offset in parallel at each tap and keep
+        # the longest run of error-free taps, then jump to its centre
+        settle = Signal(4)
+        count = Signal(window)
+        clean = Signal(noffsets)
+        offset = Signal(max=noffsets)
+        runs = Array(Signal(6) for i in range(noffsets))
+        run = Signal(6)
+        best_run = Signal(6)
+        best_tap = Signal(5)
+        best_offset = Signal(max=noffsets)
+        cycles = Signal(32)
+
+        # lock monitoring: signal_quality[24:28] leaks down by one every clean
+        # cycle, goes up by error_increment on errors and restarts the search
+        # at restart_quality
         signal_quality = Signal(28)
-        holdoff = Signal(10)
+        holdoff = Signal(holdoff_bits)
         error_seen = Signal()
 
-        self.sync.pix += [
-            error_seen.eq(0),
-            If(holdoff == 0,
-                If(invalid_symbol,
-                    error_seen.eq(1)
+        # last known good alignment, kept across restarts and tried first
+        seed_valid = Signal()
+        seed_tap = Signal(5)
+        seed_offset = Signal(max=noffsets)
+
+        fsm = FSM(reset_state="RESTART")
+        fsm = ClockDomainsRenamer("pix")(ResetInserter()(fsm))
+        self.submodules += fsm
+        self.comb += fsm.reset.eq(self.restart)
+
+        start = Signal()
+        next_tap = Signal()
+        lock = Signal()
+        seed = Signal()
+        verified = Signal()
+        self.comb += [
+            start.eq(self.restart | fsm.before_entering("SEARCH")),
+            run.eq(runs[offset]+1)
+        ]
+
+        fsm.act("RESTART",
+            If(seed_valid,
+                seed.eq(1),
+                NextState("VERIFY_SETTLE")
+            ).Else(
+                NextState("SEARCH")
+            )
+        )
+        fsm.act("VERIFY_SETTLE",
+            If(settle == 2**len(settle)-1,
+                NextState("VERIFY")
+            )
+        )
+        fsm.act("VERIFY",
+            If(count == 2**window-1,
+                NextState("VERIFY_CHECK")
+            )
+        )
+        fsm.act("VERIFY_CHECK",
+            If(Array(clean[i] for i in range(noffsets))[self.word_offset],
+                verified.eq(1),
+                NextState("ALIGN")
+            ).Else(
+                NextState("SEARCH")
+            )
+        )
+        fsm.act("SEARCH",
+            NextState("SETTLE")
+        )
+        fsm.act("SETTLE",
+            If(settle == 2**len(settle)-1,
+                NextState("MEASURE")
+            )
+        )
+        fsm.act("MEASURE",
+            If(count == 2**window-1,
+                NextState("EVALUATE")
+            )
+        )
+        if delay_search:
+            fsm.act("EVALUATE",
+                If(offset == noffsets-1,
+                    If(self.delay_count == 31,
+                        NextState("CENTER")
+                    ).Else(
+                        next_tap.eq(1),
+                        NextState("SETTLE")
+                    )
+                )
+            )
+        else:
+            fsm.act("EVALUATE",
+                If(offset == noffsets-1,
+                    NextState("CENTER")
                 )
+            )
+        fsm.act("CENTER",
+            If(best_run == 0,
+                NextState("RESTART")
             ).Else(
-                holdoff.eq(holdoff-1)
+                lock.eq(1),
+                NextState("ALIGN")
+            )
+        )
+        # let the new tap and offset reach the decoder
+        fsm.act("ALIGN",
+            If(settle == 2**len(settle)-1,
+                NextState("LOCKED")
+            )
+        )
+        fsm.act("LOCKED",
+            self.locked.eq(1),
+            If(error_seen & (signal_quality[24:28] >= restart_quality),
+                NextState("RESTART")
+            )
+        )
+
+        self.comb += [
+            self.symbol_error.eq(self.locked & invalid_symbol),
+            self.signal_quality.eq(signal_quality[24:28])
+        ]
+
+        # lock latency also counts failed search passes
+        self.sync.pix += \
+            If(self.restart | self.locked,
+                cycles.eq(0)
+            ).Else(
+                cycles.eq(cycles+1)
+            )
+
+        self.sync.pix += [
+            If(start,
+                settle.eq(0),
+                best_run.eq(0),
+                [runs[i].eq(0) for i in range(noffsets)],
+                self.delay_count.eq(0) if delay_search else []
+            ).Elif(next_tap,
+                self.delay_count.eq(self.delay_count+1)
             ),
-            self.bitslip.eq(0),
-            self.delay_ce.eq(0),
-            If(error_seen,
-                If(signal_quality[24:28] == 0xf,
-                    holdoff.eq(2**10-1),
-                    If(self.delay_count == 31,
-                        self.bitslip.eq(1)
-                    ),
-                    self.delay_count.eq(self.delay_count+1),
-                    self.delay_ce.eq(1),
-                    signal_quality[24:28].eq(0x4)
+            If(seed,
+                self.delay_count.eq(seed_tap) if delay_search else [],
+                self.word_offset.eq(seed_offset)
+            ),
+            If(fsm.ongoing("SETTLE") | fsm.ongoing("VERIFY_SETTLE") | fsm.ongoing("ALIGN"),
+                settle.eq(settle+1),
+                count.eq(0),
+                clean.eq(2**noffsets-1)
+            ),
+            If(fsm.ongoing("MEASURE") | fsm.ongoing("VERIFY"),
+                count.eq(count+1),
+                clean.eq(clean & ~invalid_symbols)
+            ),
+            If(fsm.ongoing("EVALUATE"),
+                offset.eq(offset+1),
+                If(Array(clean[i] for i in range(noffsets))[offset],
+                    runs[offset].eq(run),
+                    If(run > best_run,
+                        best_run.eq(run),
+                        best_tap.eq(self.delay_count),
+                        best_offset.eq(offset)
+                    )
                 ).Else(
-                    signal_quality.eq(signal_quality + 0x100000)
+                    runs[offset].eq(0)
                 )
             ).Else(
-                If(signal_quality[24:28] != 0,
-                    signal_quality.eq(signal_quality-1)
+                offset.eq(0)
+            ),
+            If(lock,
+                self.delay_count.eq(best_tap - ((best_run-1) >> 1)) if delay_search else [],
+                self.word_offset.eq(best_offset),
+                self.seeded.eq(0)
+            ),
+            If(verified,
+                self.seeded.eq(1)
+            ),
+            If(lock | verified,
+                holdoff.eq(2**holdoff_bits-1),
+                signal_quality[24:28].eq(lock_quality)
+            ),
+            If(fsm.before_entering("LOCKED"),
+                self.lock_cycles.eq(cycles)
+            ),
+            If(self.locked,
+                seed_valid.eq(1),
+                seed_tap.eq(self.delay_count),
+                seed_offset.eq(self.word_offset)
+            )
+        ]
+
+        self.sync.pix += [
+            error_seen.eq(0),
+            If(self.locked,
+                If(holdoff == 0,
+                    If(invalid_symbol,
+                        error_seen.eq(1)
+                    )
+                ).Else(
+                    holdoff.eq(holdoff-1)
+                ),
+                If(error_seen,
+                    If(signal_quality[24:28] < restart_quality,
+                        signal_quality.eq(signal_quality + error_increment)
+                    )
+                ).Else(
+                    If(signal_quality[24:28] != 0,
+                        signal_quality.eq(signal_quality-1)
+                    )
                 )
             )
         ]
 
-class Deserialiser1to10(Module):
+
+# behavioral models of the primitives used by Deserialiser1to10 and HDMILoopback,
+# swapped in with sim=True so the receive path can be run in the Migen simulator.
+# The analog side (the serial line) is left to the testbench, see hdmi_sim.py.
+class SimIDELAYE2(Module):
     def __init__(self):
+        self.ld = Signal()
+        self.ce = Signal()
+        self.inc = Signal()
+        self.cntvaluein = Signal(5)
+        self.cntvalueout = Signal(5)
+
+        # # #
+
+        self.sync.pix += \
+            If(self.ld,
+                self.cntvalueout.eq(self.cntvaluein)
+            ).Elif(self.ce,
+                If(self.inc,
+                    self.cntvalueout.eq(self.cntvalueout+1)
+                ).Else(
+                    self.cntvalueout.eq(self.cntvalueout-1)
+                )
+            )
+
+
+# master/slave pair in 10-bit DDR networking mode
+class SimISERDESE2(Module):
+    def __init__(self, data_width=10, latency=2):
+        self.samples = Signal(data_width) # bits sampled during the last CLKDIV cycle, bit 0 first
+        self.rst = Signal()
+        self.bitslip = Signal()
+        self.q = Signal(data_width)
+
+        # # #
+
+        history = Signal(2*data_width)
+        slip = Signal(max=data_width)
+        slip_right = Signal(reset=1)
+        word = Signal(data_width)
+        self.sync.pix += [
+            history.eq(Cat(history[data_width:], self.samples)),
+            # in DDR mode bitslip alternates between a right shift by 1 and a left shift by 3
+            If(self.bitslip,
+                slip_right.eq(~slip_right),
+                If(slip_right,
+                    If(slip == data_width-1,
+                        slip.eq(0)
+                    ).Else(
+                        slip.eq(slip+1)
+                    )
+                ).Else(
+                    If(slip < 3,
+                        slip.eq(slip+data_width-3)
+                    ).Else(
+                        slip.eq(slip-3)
+                    )
+                )
+            )
+        ]
+        self.comb += word.eq(Array(history[i:i+data_width] for i in range(data_width))[slip])
+
+        for i in range(latency):
+            next_word = Signal(data_width)
+            self.sync.pix += next_word.eq(word)
+            word = next_word
+        self.sync.pix += If(self.rst, self.q.eq(0)).Else(self.q.eq(word))
+
+
+class SimMMCME2(Module):
+    def __init__(self, lock_cycles=1024):
+        self.rst = Signal()
+        self.locked = Signal()
+
+        # # #
+
+        count = Signal(max=lock_cycles+1)
+        self.sync.pix += \
+            If(self.rst,
+                count.eq(0)
+            ).Elif(count != lock_cycles,
+                count.eq(count+1)
+            )
+        self.comb += self.locked.eq(~self.rst & (count == lock_cycles))
+
+
+class Deserialiser1to10(Module):
+    def __init__(self, sim=False):
         self.delay_ce = Signal()
         self.delay_count = Signal(5)
         self.bitslip = Signal()
@@ -248,67 +611,91 @@ class Deserialiser1to10(Module):
 
         # # #
 
-        delayed = Signal()
-        shift1 = Signal()
-        shift2 = Signal()
-
-        self.specials += [
-            Instance("IDELAYE2",
-                p_DELAY_SRC="DATAIN", p_SIGNAL_PATTERN="DATA",
-                p_CINVCTRL_SEL="FALSE", p_HIGH_PERFORMANCE_MODE="TRUE", p_REFCLK_FREQUENCY=200.0,
-                p_PIPE_SEL="FALSE", p_IDELAY_TYPE="VAR_LOAD", p_IDELAY_VALUE=0,
-
-                i_C=ClockSignal("pix"),
-                i_LD=1,
-                i_CE=self.delay_ce,
-                i_LDPIPEEN=0, i_INC=0,
-                i_CINVCTRL=0, i_CNTVALUEIN=self.delay_count,
-
-                i_DATAIN=self.serial, o_DATAOUT=delayed
-            ),
-            Instance("ISERDESE2",
-                p_DATA_WIDTH=10, p_DATA_RATE="DDR",
-                p_SERDES_MODE="MASTER", p_INTERFACE_TYPE="NETWORKING",
-                p_NUM_CE=1, p_IOBDELAY="IFD",
-
-                i_DDLY=delayed,
-                i_CE1=1, i_CE2=1,
-                i_RST=self.reset,
-                i_CLK=ClockSignal("pix5x"), i_CLKB=~ClockSignal("pix5x"), i_CLKDIV=ClockSignal("pix"),
-                i_BITSLIP=self.bitslip,
-
-                o_Q1=self.data[9], o_Q2=self.data[8],
-                o_Q3=self.data[7], o_Q4=self.data[6],
-                o_Q5=self.data[5], o_Q6=self.data[4],
-                o_Q7=self.data[3], o_Q8=self.data[2],
-
-                o_SHIFTOUT1=shift1, o_SHIFTOUT2=shift2,
-            ),
-            Instance("ISERDESE2",
-                p_DATA_WIDTH=10, p_DATA_RATE="DDR",
-                p_SERDES_MODE="SLAVE", p_INTERFACE_TYPE="NETWORKING",
-                p_NUM_CE=1, p_IOBDELAY="IFD",
-
-                i_DDLY=0,
-                i_CE1=1, i_CE2=1,
-                i_RST=self.reset,
-                i_CLK=ClockSignal("pix5x"), i_CLKB=~ClockSignal("pix5x"), i_CLKDIV=ClockSignal("pix"),
-                i_BITSLIP=self.bitslip,
-
-                o_SHIFTIN1=shift1, o_SHIFTIN2=shift2,
-
-                #o_Q1=, o_Q2=,
-                o_Q3=self.data[1], o_Q4=self.data[0],
-                #o_Q5=, o_Q6=,
-                #o_Q7=, o_Q8=
-            ),
-        ]
+        if sim:
+            self.submodules.idelay = SimIDELAYE2()
+            self.submodules.iserdes = SimISERDESE2()
+            self.comb += [
+                self.idelay.ld.eq(1),
+                self.idelay.ce.eq(self.delay_ce),
+                self.idelay.cntvaluein.eq(self.delay_count),
+                self.iserdes.rst.eq(self.reset),
+                self.iserdes.bitslip.eq(self.bitslip),
+                self.data.eq(self.iserdes.q)
+            ]
+        else:
+            delayed = Signal()
+            shift1 = Signal()
+            shift2 = Signal()
+
+            self.specials += [
+                Instance("IDELAYE2",
+                    p_DELAY_SRC="DATAIN", p_SIGNAL_PATTERN="DATA",
+                    p_CINVCTRL_SEL="FALSE", p_HIGH_PERFORMANCE_MODE="TRUE", p_REFCLK_FREQUENCY=200.0,
+                    p_PIPE_SEL="FALSE", p_IDELAY_TYPE="VAR_LOAD", p_IDELAY_VALUE=0,
+
+                    i_C=ClockSignal("pix"),
+                    i_LD=1,
+                    i_CE=self.delay_ce,
+                    i_LDPIPEEN=0, i_INC=0,
+                    i_CINVCTRL=0, i_CNTVALUEIN=self.delay_count,
+
+                    i_DATAIN=self.serial, o_DATAOUT=delayed
+                ),
+                Instance("ISERDESE2",
+                    p_DATA_WIDTH=10, p_DATA_RATE="DDR",
+                    p_SERDES_MODE="MASTER", p_INTERFACE_TYPE="NETWORKING",
+                    p_NUM_CE=1, p_IOBDELAY="IFD",
+
+                    i_DDLY=delayed,
+                    i_CE1=1, i_CE2=1,
+                    i_RST=self.reset,
+                    i_CLK=ClockSignal("pix5x"), i_CLKB=~ClockSignal("pix5x"), i_CLKDIV=ClockSignal("pix"),
+                    i_BITSLIP=self.bitslip,
+
+                    o_Q1=self.data[9], o_Q2=self.data[8],
+                    o_Q3=self.data[7], o_Q4=self.data[6],
+                    o_Q5=self.data[5], o_Q6=self.data[4],
+                    o_Q7=self.data[3], o_Q8=self.data[2],
+
+                    o_SHIFTOUT1=shift1, o_SHIFTOUT2=shift2,
+                ),
+                Instance("ISERDESE2",
+                    p_DATA_WIDTH=10, p_DATA_RATE="DDR",
+                    p_SERDES_MODE="SLAVE", p_INTERFACE_TYPE="NETWORKING",
+                    p_NUM_CE=1, p_IOBDELAY="IFD",
+
+                    i_DDLY=0,
+                    i_CE1=1, i_CE2=1,
+                    i_RST=self.reset,
+                    i_CLK=ClockSignal("pix5x"), i_CLKB=~ClockSignal("pix5x"), i_CLKDIV=ClockSignal("pix"),
+                    i_BITSLIP=self.bitslip,
+
+                    o_SHIFTIN1=shift1, o_SHIFTIN2=shift2,
+
+                    #o_Q1=, o_Q2=,
+                    o_Q3=self.data[1], o_Q4=self.data[0],
+                    #o_Q5=, o_Q6=,
+                    #o_Q7=, o_Q8=
+                ),
+            ]
 
 
 class HDMIInputChannel(Module):
-    def __init__(self, data):
+    def __init__(self, data, sim=False, **alignment):
         self.reset = Signal()
 
+        self.locked = Signal()
+        self.lock_cycles = Signal(32)
+        self.seeded = Signal()
+        self.symbol_error = Signal()
+        self.signal_quality = Signal(4)
+        self.delay_count = Signal(5)
+        self.word_offset = Signal(4)
+
+        # idelay tap forced from outside (e.g. eye sweeps)
+        self.manual_delay = Signal()
+        self.manual_delay_count = Signal(5)
+
         self.ctl_valid = Signal()
         self.ctl = Signal(2)
 
@@ -317,28 +704,45 @@ class HDMIInputChannel(Module):
 
         # # #
 
-        delay_ce = Signal()
-        delay_count = Signal(5)
-        bitslip = Signal()
+        # aligned symbol, before decoding
+        self.symbol = symbol = Signal(10)
 
-        symbol = Signal(10)
+        self.submodules.deserialiser = deserialiser = Deserialiser1to10(sim)
+        self.comb += [
+            deserialiser.reset.eq(self.reset),
+            deserialiser.serial.eq(data)
+        ]
 
-        invalid_symbol_detector = InvalidSymbolDetector(symbol)
-        self.submodules += invalid_symbol_detector
+        # word alignment, every offset of the last two words is checked in parallel
+        previous = Signal(10)
+        self.sync.pix += previous.eq(deserialiser.data)
+        words = Cat(previous, deserialiser.data)
 
-        alignment_detector = AlignmentDetector(invalid_symbol_detector.invalid)
-        self.submodules += alignment_detector
+        invalid_symbols = Signal(10)
+        for i in range(10):
+            invalid_symbol_detector = InvalidSymbolDetector(words[i:i+10])
+            self.submodules += invalid_symbol_detector
+            self.comb += invalid_symbols[i].eq(invalid_symbol_detector.invalid)
 
-        deserialiser = Deserialiser1to10()
-        self.submodules += deserialiser
+        alignment_detector = AlignmentDetector(invalid_symbols, **alignment)
+        self.submodules += alignment_detector
         self.comb += [
-            deserialiser.delay_ce.eq(alignment_detector.delay_ce),
-            deserialiser.delay_count.eq(alignment_detector.delay_count),
-            deserialiser.bitslip.eq(alignment_detector.bitslip),
-            deserialiser.reset.eq(self.reset),
-            deserialiser.serial.eq(data),
-            symbol.eq(deserialiser.data)
+            alignment_detector.restart.eq(self.reset),
+            self.locked.eq(alignment_detector.locked),
+            self.lock_cycles.eq(alignment_detector.lock_cycles),
+            self.seeded.eq(alignment_detector.seeded),
+            self.symbol_error.eq(alignment_detector.symbol_error),
+            self.signal_quality.eq(alignment_detector.signal_quality),
+            self.delay_count.eq(deserialiser.delay_count),
+            self.word_offset.eq(alignment_detector.word_offset)
         ]
+        self.sync.pix += symbol.eq(Array(words[i:i+10] for i in range(10))[alignment_detector.word_offset])
+
+        self.comb += If(self.manual_delay,
+                deserialiser.delay_count.eq(self.manual_delay_count)
+            ).Else(
+                deserialiser.delay_count.eq(alignment_detector.delay_count)
+            )
 
         decoder = Decoding()
         self.submodules += decoder
@@ -357,97 +761,1686 @@ class HDMIInputChannel(Module):
             )
         ]
 
-class HDMILoopback(Module):
-    def __init__(self, platform):
-        self.submodules.crg = _CRG(platform)
+class ChannelBonding(Module):
+    def __init__(self, nchan=3, depth=8):
+        self.valid_i = Signal()
+        self.data_in = [Record(channel_layout) for i in range(nchan)]
 
-        hdmi_in_pads = platform.request("hdmi_in")
-        hdmi_out_pads = platform.request("hdmi_out")
+        self.synced = Signal()
+        self.valid = Signal()
+        self.data_out = [Record(channel_layout) for i in range(nchan)]
+        self.overflow = Signal()
+
+        # # #
+
+        # each lane is written every cycle into a small elastic buffer and read
+        # unless it waits at the start of a data period for the other lanes.
+        # a lane that would wait for more than depth-1 cycles (lane skew the
+        # buffer cannot absorb) overflows: all lanes restart as when unlocked
+        # and bonding is searched again.
+        at_start = Signal(nchan)
+        read = Signal(nchan)
+        full = Signal(nchan)
+        resync = Signal()
+        for i in range(nchan):
+            produce = Signal(log2_int(depth))
+            consume = Signal(log2_int(depth))
+            storage = Memory(layout_len(channel_layout), depth)
+            wrport = storage.get_port(write_capable=True, clock_domain="pix")
+            rdport = storage.get_port(async_read=True, clock_domain="pix")
+            self.specials += storage, wrport, rdport
+
+            head = Record(channel_layout)
+            last_de = Signal()
+            level = Signal(log2_int(depth))
+            self.comb += [
+                wrport.adr.eq(produce),
+                wrport.dat_w.eq(self.data_in[i].raw_bits()),
+                wrport.we.eq(1),
+                rdport.adr.eq(consume),
+                head.raw_bits().eq(rdport.dat_r),
+                at_start[i].eq(head.de & ~last_de),
+                level.eq(produce - consume),
+                # never empty (at least last cycle's write), 0 is full
+                full[i].eq(level == 0)
+            ]
+            self.sync.pix += [
+                produce.eq(produce+1),
+                # until all lanes are locked, read what was written last cycle
+                If(resync,
+                    consume.eq(produce),
+                    last_de.eq(head.de)
+                ).Elif(read[i],
+                    consume.eq(consume+1),
+                    last_de.eq(head.de),
+                    self.data_out[i].raw_bits().eq(head.raw_bits())
+                )
+            ]
+
+        all_at_start = Signal()
+        self.comb += [
+            all_at_start.eq(at_start == 2**nchan-1),
+            read.eq(Replicate(all_at_start, nchan) | ~at_start),
+            self.overflow.eq(self.valid_i & ((full & ~read) != 0)),
+            resync.eq(~self.valid_i | self.overflow)
+        ]
+        self.sync.pix += [
+            If(resync,
+                self.synced.eq(0)
+            ).Elif(at_start != 0,
+                self.synced.eq(all_at_start)
+            ),
+            self.valid.eq(~resync & (read == 2**nchan-1) & (self.synced | all_at_start))
+        ]
+
+
+def gray_to_binary(gray):
+    return Cat(*[reduce(xor, gray[i:]) for i in range(len(gray))])
+
+
+class FrequencyMeter(Module):
+    def __init__(self, period=100000, width=20, clock_domain="pix_in"):
+        self.value = Signal(width)
+        self.valid = Signal()
+
+        # # #
+
+        # gray coded counter in the measured domain, sampled by sys
+        counter = ClockDomainsRenamer(clock_domain)(GrayCounter(width))
+        self.submodules += counter
+        self.comb += counter.ce.eq(1)
+
+        gray = Signal(width)
+        binary = Signal(width)
+        last = Signal(width)
+        self.specials += MultiReg(counter.q, gray)
+        self.comb += binary.eq(gray_to_binary(gray))
+
+        timer = Signal(max=period, reset=period-1)
+        self.sync += [
+            self.valid.eq(0),
+            If(timer == 0,
+                timer.eq(period-1),
+                self.value.eq(binary - last),
+                self.valid.eq(1),
+                last.eq(binary)
+            ).Else(
+                timer.eq(timer-1)
+            )
+        ]
+
+
+def _mmcm_divider(divide):
+    if divide == 1:
+        return 1, 1, 0, 1
+    high = divide//2
+    return high, divide - high, divide%2, 0
+
+
+# mmcm drp writes (address, mask of bits to keep, value) for one output configuration
+def mmcm_drp_config(divclk, clkout0, clkout1, clkout2):
+    high, low, edge, no_count = _mmcm_divider(clkout0)
+    config = [(0x08, 0x1000, (high << 6) | low), (0x09, 0x8000, (edge << 7) | (no_count << 6))]
+    high, low, edge, no_count = _mmcm_divider(clkout1)
+    config += [(0x0a, 0x1000, (high << 6) | low), (0x0b, 0xfc00, (edge << 7) | (no_count << 6))]
+    high, low, edge, no_count = _mmcm_divider(clkout2)
+    config += [(0x0c, 0x1000, (high << 6) | low), (0x0d, 0xfc00, (edge << 7) | (no_count << 6))]
+    high, low, edge, no_count = _mmcm_divider(divclk)
+    config += [(0x16, 0xc000, (edge << 13) | (no_count << 12) | (high << 6) | low)]
+    return config
+
+
+# pixel clock bands (upper limit in kHz, divclk), CLKFBOUT_MULT is fixed at 40
+# so that the lock and filter settings never change and VCO = 40*f/divclk
+pix_clock_bands = [
+    (30000, 1),
+    (60000, 2),
+    (120000, 4),
+    (240000, 8)
+]
+# mmcm VCO range of the -1 speed grade (kHz)
+mmcm_vco_min = 600000
+mmcm_vco_max = 1200000
+# a band is left when the pixel clock is pix_clock_band_hysteresis kHz past
+# one of its limits on pix_clock_band_measurements measurements in a row, so
+# that a clock sitting on a limit does not keep reprogramming the mmcm. the
+# hysteresis is the largest that keeps the VCO of every band in range, which
+# is none with octave bands: each of them already spans the whole VCO range.
+pix_clock_band_hysteresis = min(
+    [mmcm_vco_max*divclk//40 - limit for limit, divclk in pix_clock_bands[:-1]] +
+    [limit - mmcm_vco_min*divclk//40 for (limit, _), (_, divclk) in zip(pix_clock_bands, pix_clock_bands[1:])])
+pix_clock_band_measurements = 3
+
+
+def pix_clock_band_range(band):
+    # pixel clocks (kHz) held by a band once selected: low <= f < high, None
+    # when unbounded
+    low = pix_clock_bands[band-1][0] - pix_clock_band_hysteresis if band > 0 else None
+    high = pix_clock_bands[band][0] + pix_clock_band_hysteresis if band < len(pix_clock_bands)-1 else None
+    return low, high
+
+
+class MMCMReconfig(Module):
+    def __init__(self, configs):
+        self.start = Signal()
+        self.config = Signal(max=len(configs))
+        self.busy = Signal()
+
+        self.mmcm_reset = Signal()
+        self.drp_addr = Signal(7)
+        self.drp_di = Signal(16)
+        self.drp_do = Signal(16)
+        self.drp_en = Signal()
+        self.drp_we = Signal()
+        self.drp_rdy = Signal()
+
+        # # #
+
+        nregs = len(configs[0])
+        addrs = Array(addr for config in configs for addr, mask, value in config)
+        masks = Array(mask for config in configs for addr, mask, value in config)
+        values = Array(value for config in configs for addr, mask, value in config)
+
+        config = Signal(max=len(configs))
+        reg = Signal(max=nregs)
+        index = Signal(max=len(addrs))
+        data = Signal(16)
+        self.comb += [
+            index.eq(config*nregs + reg),
+            self.drp_addr.eq(addrs[index]),
+            self.drp_di.eq(data)
+        ]
+
+        # the mmcm is held in reset while its registers are rewritten
+        fsm = FSM(reset_state="IDLE")
+        self.submodules += fsm
+        fsm.act("IDLE",
+            If(self.start,
+                NextValue(config, self.config),
+                NextValue(reg, 0),
+                NextState("RESET")
+            )
+        )
+        fsm.act("RESET",
+            self.mmcm_reset.eq(1),
+            self.busy.eq(1),
+            NextState("READ")
+        )
+        fsm.act("READ",
+            self.mmcm_reset.eq(1),
+            self.busy.eq(1),
+            self.drp_en.eq(1),
+            NextState("WAIT_READ")
+        )
+        fsm.act("WAIT_READ",
+            self.mmcm_reset.eq(1),
+            self.busy.eq(1),
+            If(self.drp_rdy,
+                NextValue(data, (self.drp_do & masks[index]) | values[index]),
+                NextState("WRITE")
+            )
+        )
+        fsm.act("WRITE",
+            self.mmcm_reset.eq(1),
+            self.busy.eq(1),
+            self.drp_en.eq(1),
+            self.drp_we.eq(1),
+            NextState("WAIT_WRITE")
+        )
+        fsm.act("WAIT_WRITE",
+            self.mmcm_reset.eq(1),
+            self.busy.eq(1),
+            If(self.drp_rdy,
+                If(reg == nregs-1,
+                    NextState("IDLE")
+                ).Else(
+                    NextValue(reg, reg+1),
+                    NextState("READ")
+                )
+            )
+        )
+
+
+pixel_layout = [
+    ("valid", 1),
+    ("de", 1),
+    ("hsync", 1),
+    ("vsync", 1),
+    ("r", 8),
+    ("g", 8),
+    ("b", 8)
+]
+
+
+pixel2_layout = [
+    ("valid", 1),
+    ("p0", pixel_layout[1:]),
+    ("p1", pixel_layout[1:])
+]
+
+
+class PixelGearbox(Module):
+    def __init__(self):
+        self.sink = Record(pixel_layout)
+        self.source = Record(pixel2_layout)
+
+        # # #
+
+        # pixels are paired in pix and each pair is held for two cycles, so
+        # it is sampled once by the edge aligned pix_div2 clock (p0 first)
+        phase = Signal()
+        first = Record(pixel_layout)
+        pair = Record(pixel2_layout)
+        self.sync.pix += [
+            phase.eq(~phase),
+            If(~phase,
+                first.eq(self.sink)
+            ).Else(
+                pair.valid.eq(first.valid & self.sink.valid),
+                pair.p0.eq(first),
+                pair.p1.eq(self.sink)
+            )
+        ]
+        self.sync.pix_div2 += self.source.eq(pair)
+
+
+ycbcr422_layout = [
+    ("valid", 1),
+    ("de", 1),
+    ("hsync", 1),
+    ("vsync", 1),
+    ("y", 8),
+    ("c", 8)
+]
+
+
+class RGBToYCbCr422(Module, AutoCSR):
+    def __init__(self):
+        self.sink = Record(pixel_layout)
+        self.source = Record(ycbcr422_layout)
+
+        standards = list(colorspace.ycbcr_standards)
+        self._standard = CSRStorage(bits_for(len(standards)-1))
+
+        # # #
+
+        # one pixel per clock: registered inputs and coefficients, products,
+        # sums, clamping (dsp48 a/b, m and p registers), then chroma averaging
+        # over pixel pairs (cb on even pixels, cr on odd ones). colorspace.py is
+        # the bit exact reference.
+        frac_bits = colorspace.frac_bits
+        standard = Signal(max=len(standards))
+        self.specials += MultiReg(self._standard.storage, standard, "pix")
+
+        configs = [colorspace.ycbcr_coefficients(s) for s in standards]
+        pipeline = [Record(pixel_layout) for i in range(4)]
+        self.sync.pix += [a.eq(b) for a, b in zip(pipeline, [self.sink] + pipeline[:-1])]
+        rgb = [pipeline[0].r, pipeline[0].g, pipeline[0].b]
+
+        components = []
+        for row in range(3):
+            products = []
+            for col in range(3):
+                coefficient = Signal((18, True))
+                product = Signal((27, True))
+                self.sync.pix += [
+                    coefficient.eq(Array(C(matrix[row][col], (18, True)) for matrix, offsets in configs)[standard]),
+                    product.eq(rgb[col]*coefficient)
+                ]
+                products.append(product)
+            total = Signal((29, True))
+            component = Signal(8)
+            self.sync.pix += [
+                total.eq(products[0] + products[1] + products[2] +
+                         Array(C(offsets[row], 29) for matrix, offsets in configs)[standard]),
+                If(total < 0,
+                    component.eq(0)
+                ).Elif(total[frac_bits:] > 255,
+                    component.eq(255)
+                ).Else(
+                    component.eq(total[frac_bits:])
+                )
+            ]
+            components.append(component)
+        y, cb, cr = components
+        pixel = pipeline[-1]
+
+        # the output is one pixel behind so that both pixels of a pair are
+        # known, the last pixel of an odd line keeps its own cb
+        last = Record(pixel_layout)
+        last_y = Signal(8)
+        last_cb = Signal(8)
+        last_cr = Signal(8)
+        last_odd = Signal()
+        cr_pair = Signal(8)
+        self.sync.pix += [
+            last.eq(pixel),
+            last_y.eq(y),
+            last_cb.eq(cb),
+            last_cr.eq(cr),
+            last_odd.eq(pixel.de & last.de & ~last_odd),
+            self.source.valid.eq(last.valid),
+            self.source.de.eq(last.de),
+            self.source.hsync.eq(last.hsync),
+            self.source.vsync.eq(last.vsync),
+            self.source.y.eq(last_y),
+            If(last_odd,
+                self.source.c.eq(cr_pair)
+            ).Elif(pixel.de,
+                self.source.c.eq((last_cb + cb + 1) >> 1),
+                cr_pair.eq((last_cr + cr + 1) >> 1)
+            ).Else(
+                self.source.c.eq(last_cb)
+            )
+        ]
+
+
+timing_layout = [
+    ("hactive", 12),
+    ("htotal", 12),
+    ("vactive", 12),
+    ("vtotal", 12),
+    ("hsync_pol", 1),
+    ("vsync_pol", 1),
+    ("frame_cycles", 24),
+    ("stable", 1)
+]
+
+
+class TimingDetector(Module, AutoCSR):
+    def __init__(self, pixels, nframes=4):
+        self.timing = Record(timing_layout)
+
+        for name, width in timing_layout:
+            setattr(self, "_" + name, CSRStatus(width, name=name))
+
+        # # #
+
+        # measurements are in pixels.valid cycles, a frame starts on the
+        # active edge of vsync; syncs are forced low during active video so
+        # the polarities are sampled on the first blank cycle after it
+        last_de = Signal()
+        last_hsync = Signal()
+        last_vsync = Signal()
+        hcount = Signal(12)
+        vactive = Signal(12)
+        vtotal = Signal(12)
+        frame_cycles = Signal(24)
+        measured = Record(timing_layout)
+        consistent = Signal(max=nframes+1)
+
+        de_rise = Signal()
+        de_fall = Signal()
+        hsync_start = Signal()
+        vsync_start = Signal()
+        self.comb += [
+            de_rise.eq(pixels.de & ~last_de),
+            de_fall.eq(~pixels.de & last_de),
+            hsync_start.eq(~pixels.de & (pixels.hsync == measured.hsync_pol) & (last_hsync != measured.hsync_pol)),
+            vsync_start.eq(~pixels.de & (pixels.vsync == measured.vsync_pol) & (last_vsync != measured.vsync_pol)),
+            measured.vactive.eq(vactive),
+            measured.vtotal.eq(vtotal),
+            measured.frame_cycles.eq(frame_cycles)
+        ]
+
+        fields = [name for name, width in timing_layout if name != "stable"]
+        self.sync.pix += If(pixels.valid,
+            last_de.eq(pixels.de),
+            last_hsync.eq(pixels.hsync),
+            last_vsync.eq(pixels.vsync),
+            hcount.eq(hcount+1),
+            frame_cycles.eq(frame_cycles+1),
+            If(de_fall,
+                measured.hactive.eq(hcount),
+                measured.hsync_pol.eq(~pixels.hsync),
+                measured.vsync_pol.eq(~pixels.vsync)
+            ),
+            If(de_rise,
+                hcount.eq(1),
+                vactive.eq(vactive+1),
+                If(vactive != 0,
+                    measured.htotal.eq(hcount)
+                )
+            ),
+            If(hsync_start,
+                vtotal.eq(vtotal+1)
+            ),
+            If(vsync_start,
+                frame_cycles.eq(1),
+                vactive.eq(0),
+                vtotal.eq(hsync_start),
+                [getattr(self.timing, name).eq(getattr(measured, name)) for name in fields],
+                If(Cat(*[getattr(measured, name) for name in fields]) ==
+                   Cat(*[getattr(self.timing, name) for name in fields]),
+                    If(consistent != nframes,
+                        consistent.eq(consistent+1)
+                    )
+                ).Else(
+                    consistent.eq(0)
+                )
+            )
+        )
+        self.comb += self.timing.stable.eq(consistent == nframes)
+
+        for name, width in timing_layout:
+            self.specials += MultiReg(getattr(self.timing, name), getattr(self, "_" + name).status)
+
+
+class FrameCapture(Module, AutoCSR):
+    def __init__(self, dram_port, nslots=4, fifo_depth=512, ycbcr=False):
+        self.sink = Record(ycbcr422_layout if ycbcr else pixel_layout)
+        self.timing = Record(timing_layout)
+
+        self._enable = CSRStorage()
+        self._base = CSRStorage(32)
+        self._frame_size = CSRStorage(32)
+        self._last_slot = CSRStatus(bits_for(nslots-1))
+        self._frames = CSRStatus(32)
+        self._overflows = CSRStatus(32)
+        self._underruns = CSRStatus(32)
+
+        # # #
+
+        dw = dram_port.dw
+        bpp = 16 if ycbcr else 32
+        ratio = dw//bpp
+        offset_bits = log2_int(dw//8)
+
+        fifo = ClockDomainsRenamer({"write": "pix", "read": "sys"})(AsyncFIFO(1 + dw, fifo_depth))
+        self.submodules += fifo
+
+        # pix domain: pack active pixels as 32 bit xRGB (or 16 bit YCbCr 4:2:2,
+        # Y then C) into dram words, the first word of a frame is flagged
+        # (first pixel after a vsync edge)
+        sof_pending = Signal()
+        last_vsync = Signal()
+        word = Signal(dw)
+        word_sof = Signal()
+        if ycbcr:
+            pixel = Cat(self.sink.y, self.sink.c)
+        else:
+            pixel = Cat(self.sink.b, self.sink.g, self.sink.r, C(0, 8))
+        n = Signal(max=max(ratio, 2))
+        position = Signal(max=max(ratio, 2))
+        self.comb += [
+            position.eq(Mux(sof_pending, 0, n)),
+            fifo.din.eq(Cat(word_sof, word))
+        ]
+        self.sync.pix += [
+            fifo.we.eq(0),
+            If(self.sink.valid,
+                last_vsync.eq(self.sink.vsync),
+                If(self.sink.vsync != last_vsync,
+                    sof_pending.eq(1)
+                ),
+                If(self.sink.de,
+                    sof_pending.eq(0),
+                    word.eq(Cat(word[bpp:], pixel)),
+                    If(position == 0,
+                        word_sof.eq(sof_pending)
+                    ),
+                    If(position == ratio-1,
+                        n.eq(0),
+                        fifo.we.eq(1)
+                    ).Else(
+                        n.eq(position+1)
+                    )
+                )
+            )
+        ]
+
+        overflows = ClockDomainsRenamer("pix")(GrayCounter(32))
+        overflows_gray = Signal(32)
+        self.submodules += overflows
+        self.specials += MultiReg(overflows.q, overflows_gray)
+        self.comb += [
+            overflows.ce.eq(fifo.we & ~fifo.writable),
+            self._overflows.status.eq(gray_to_binary(overflows_gray))
+        ]
+
+        # sys domain: write frames into a ring of nslots buffers, frames
+        # shorter than frame_size are counted and their slot is reused
+        self.submodules.dma = dma = LiteDRAMDMAWriter(dram_port)
+
+        # a frame_size of 0 uses the size measured by the timing detector,
+        # nothing is captured until it is stable
+        hactive = Signal(12)
+        vactive = Signal(12)
+        stable = Signal()
+        detected_words = Signal(dram_port.aw)
+        self.specials += [
+            MultiReg(self.timing.hactive, hactive),
+            MultiReg(self.timing.vactive, vactive),
+            MultiReg(self.timing.stable, stable)
+        ]
+        self.sync += detected_words.eq((hactive*vactive) >> log2_int(ratio))
+
+        base = Signal(dram_port.aw)
+        frame_words = Signal(dram_port.aw)
+        frame_words_valid = Signal()
+        self.comb += [
+            base.eq(self._base.storage[offset_bits:]),
+            If(self._frame_size.storage == 0,
+                frame_words.eq(detected_words),
+                frame_words_valid.eq(stable)
+            ).Else(
+                frame_words.eq(self._frame_size.storage[offset_bits:]),
+                frame_words_valid.eq(1)
+            )
+        ]
+
+        capturing = Signal()
+        boundary = Signal()
+        writing = Signal()
+        slot = Signal(max=nslots)
+        slot_base = Signal(dram_port.aw)
+        offset = Signal(dram_port.aw)
+        sof = fifo.dout[0]
+        self.comb += [
+            writing.eq(capturing & (offset != frame_words)),
+            dma.sink.address.eq(slot_base + offset),
+            dma.sink.data.eq(fifo.dout[1:]),
+            If(fifo.readable & (~sof | boundary),
+                dma.sink.valid.eq(writing),
+                fifo.re.eq(dma.sink.ready | ~writing)
+            )
+        ]
+        self.sync += [
+            If(fifo.readable & sof & ~boundary,
+                boundary.eq(1),
+                capturing.eq(self._enable.storage & frame_words_valid & (frame_words != 0)),
+                offset.eq(0),
+                If(~capturing,
+                    slot.eq(0),
+                    slot_base.eq(base)
+                ).Elif(offset == frame_words,
+                    self._last_slot.status.eq(slot),
+                    self._frames.status.eq(self._frames.status + 1),
+                    If(slot == nslots-1,
+                        slot.eq(0),
+                        slot_base.eq(base)
+                    ).Else(
+                        slot.eq(slot+1),
+                        slot_base.eq(slot_base + frame_words)
+                    )
+                ).Else(
+                    self._underruns.status.eq(self._underruns.status + 1)
+                )
+            ).Elif(fifo.re,
+                boundary.eq(0),
+                If(writing,
+                    offset.eq(offset+1)
+                )
+            )
+        ]
+
+
+def _crc_next(state, data, polynomial=0x04c11db7):
+    # parallel crc, data bit 0 first: each bit of the next state is the xor of
+    # the state (0..n-1) and data (n..) bits it depends on
+    n = len(state)
+    bits = [state[i] for i in range(n)] + [data[i] for i in range(len(data))]
+    terms = [{i} for i in range(n)]
+    for j in range(len(data)):
+        feedback = terms[-1] ^ {n + j}
+        terms = [feedback] + [terms[i-1] ^ feedback if (polynomial >> i) & 1 else terms[i-1]
+                              for i in range(1, n)]
+    return Cat(*[reduce(xor, [bits[k] for k in sorted(t)]) for t in terms])
+
+
+class TileChangeDetector(Module, AutoCSR):
+    def __init__(self, tile_bits=4, max_cols=128, max_tiles=8192):
+        self.sink = Record(pixel_layout)
+
+        # one strobe per tile, in raster order, once its last line is seen
+        self.tile_valid = Signal()
+        self.tile_index = Signal(max=max_tiles)
+        self.tile_dirty = Signal()
+
+        self._enable = CSRStorage(reset=1)
+        self._frames = CSRStatus(32)
+        self._tiles = CSRStatus(bits_for(max_tiles))
+        self._dirty_tiles = CSRStatus(bits_for(max_tiles))
+        self._bitmap_index = CSRStorage(log2_int(max_tiles//32))
+        self._bitmap = CSRStatus(32)
+
+        # # #
+
+        # tiles are hashed with a crc32 of their pixels, accumulated per tile
+        # column over the lines of a tile row. a tile row is finished on the
+        # first line of the next one (the last row of a frame on the first line
+        # of the next frame): its hash is compared with the one of the same
+        # tile in the previous frame and the result goes to a dirty bitmap,
+        # double buffered by frame. enable is sampled at frame starts, while
+        # it is cleared hashes and bitmap are frozen so the next bitmap is
+        # relative to the last frame seen.
+        tile_size = 2**tile_bits
+        enable = Signal()
+        self.specials += MultiReg(self._enable.storage, enable, "pix")
+
+        pixel = Record(pixel_layout)
+        self.sync.pix += pixel.eq(self.sink)
+        de = pixel.valid & pixel.de
+
+        # line within the frame, updated with the first pixel of each line
+        sof_pending = Signal()
+        last_vsync = Signal()
+        last_de = Signal()
+        line_start = Signal()
+        line_end = Signal()
+        x = Signal(max=max_cols*tile_size)
+        y = Signal(12)
+        line = Signal(12)
+        parity = Signal()
+        active = Signal()
+        last_active = Signal()
+        self.comb += [
+            line_start.eq(de & ~last_de),
+            line_end.eq(pixel.valid & ~pixel.de & last_de),
+            If(line_start,
+                line.eq(Mux(sof_pending, 0, y+1))
+            ).Else(
+                line.eq(y)
+            )
+        ]
+        self.sync.pix += If(pixel.valid,
+            last_vsync.eq(pixel.vsync),
+            last_de.eq(pixel.de),
+            If(pixel.vsync != last_vsync,
+                sof_pending.eq(1)
+            ),
+            If(pixel.de,
+                x.eq(x+1)
+            ).Else(
+                x.eq(0)
+            ),
+            If(line_start,
+                y.eq(line),
+                If(sof_pending,
+                    sof_pending.eq(0),
+                    parity.eq(~parity),
+                    active.eq(enable),
+                    last_active.eq(active)
+                )
+            )
+        )
+        new_frame = line_start & sof_pending
+        frame_parity = Mux(new_frame, ~parity, parity)
+        frame_active = Mux(new_frame, enable, active)
+        previous_active = Mux(new_frame, active, last_active)
+
+        col = x[tile_bits:]
+        segment_start = de & (x[:tile_bits] == 0)
+        first_line = line[:tile_bits] == 0
+
+        # running hashes per tile column
+        hashes = Memory(32, max_cols)
+        hash_read = hashes.get_port(clock_domain="pix")
+        hash_write = hashes.get_port(write_capable=True, clock_domain="pix")
+        self.specials += hashes, hash_read, hash_write
+        state = Signal(32)
+        hash_in = Signal(32)
+        hash_next = Signal(32)
+        self.comb += [
+            hash_read.adr.eq(Mux(pixel.de, col+1, 0)),
+            If(segment_start,
+                hash_in.eq(Mux(first_line, 2**32-1, hash_read.dat_r))
+            ).Else(
+                hash_in.eq(state)
+            ),
+            hash_next.eq(_crc_next(hash_in, Cat(pixel.b, pixel.g, pixel.r))),
+            hash_write.adr.eq(col),
+            hash_write.dat_w.eq(hash_next),
+            hash_write.we.eq(de & frame_active)
+        ]
+        self.sync.pix += state.eq(hash_next)
+
+        # previous frame signatures and dirty bitmaps
+        signatures = Memory(32, max_tiles)
+        signature_read = signatures.get_port(clock_domain="pix")
+        signature_write = signatures.get_port(write_capable=True, clock_domain="pix")
+        bitmaps = Memory(32, 2*max_tiles//32)
+        bitmap_write = bitmaps.get_port(write_capable=True, clock_domain="pix")
+        bitmap_read = bitmaps.get_port(clock_domain="sys")
+        self.specials += signatures, signature_read, signature_write, bitmaps, bitmap_write, bitmap_read
+
+        finish = Signal()
+        index = Signal(max=max_tiles)
+        dirty = Signal()
+        word = Signal(32)
+        word_next = Signal(32)
+        dirty_tiles = Signal(bits_for(max_tiles))
+        self.comb += [
+            # line 0 finishes the last row of the previous frame
+            finish.eq(segment_start & first_line & Mux(line == 0, previous_active, frame_active)),
+            signature_read.adr.eq(index),
+            signature_write.adr.eq(index),
+            signature_write.dat_w.eq(hash_read.dat_r),
+            signature_write.we.eq(finish),
+            dirty.eq(hash_read.dat_r != signature_read.dat_r),
+            word_next.eq(Mux(index[:5] == 0, 0, word) | (dirty << index[:5])),
+            bitmap_write.adr.eq(Cat(index[5:], Mux(line == 0, ~frame_parity, frame_parity))),
+            bitmap_write.dat_w.eq(word_next),
+            bitmap_write.we.eq(finish)
+        ]
+
+        # a frame is complete at the end of line 0 of the next one
+        frames = Signal(32)
+        tiles = Signal(bits_for(max_tiles))
+        last_dirty_tiles = Signal(bits_for(max_tiles))
+        bank = Signal()
+        self.sync.pix += [
+            self.tile_valid.eq(finish),
+            self.tile_index.eq(index),
+            self.tile_dirty.eq(dirty),
+            If(finish,
+                index.eq(index+1),
+                word.eq(word_next),
+                dirty_tiles.eq(dirty_tiles + dirty)
+            ),
+            If(line_end & (y == 0),
+                index.eq(0),
+                dirty_tiles.eq(0),
+                If(last_active,
+                    frames.eq(frames+1),
+                    tiles.eq(index),
+                    last_dirty_tiles.eq(dirty_tiles),
+                    bank.eq(~parity)
+                )
+            )
+        ]
+
+        # results change once per frame, well apart from host reads
+        self.specials += [
+            MultiReg(frames, self._frames.status),
+            MultiReg(tiles, self._tiles.status),
+            MultiReg(last_dirty_tiles, self._dirty_tiles.status)
+        ]
+        bitmap_bank = Signal()
+        self.specials += MultiReg(bank, bitmap_bank)
+        self.comb += [
+            bitmap_read.adr.eq(Cat(self._bitmap_index.storage, bitmap_bank)),
+            self._bitmap.status.eq(bitmap_read.dat_r)
+        ]
+
+
+def _add_snapshot(module, update, value, csr):
+    # sampled in the pix domain on update, static while the host reads it
+    snapshot = Signal(len(value))
+    module.sync.pix += If(update, snapshot.eq(value))
+    module.specials += MultiReg(snapshot, csr.status)
+
+
+class ChannelStatus(Module, AutoCSR):
+    def __init__(self, chan, update, tick):
+        self._locked = CSRStatus()
+        self._delay_count = CSRStatus(5)
+        self._word_offset = CSRStatus(4)
+        self._signal_quality = CSRStatus(4)
+        self._alignments = CSRStatus(16)
+        self._symbol_errors = CSRStatus(32)
+        self._locked_time = CSRStatus(32)
+        self._lock_cycles = CSRStatus(32)
+        self._seeded = CSRStatus()
+        self._retrains = CSRStatus(16)
+
+        # # #
+
+        # the IDELAY tap does not follow the eye while locked: a drift of the eye
+        # past the sampling point ends in a lock loss, and when the last known good
+        # alignment no longer verifies, in a full search. retrains counts the locks
+        # that needed a full search after a previous lock.
+        last_locked = Signal()
+        relock = Signal()
+        alignments = Signal(16)
+        retrains = Signal(16)
+        symbol_errors = Signal(32)
+        locked_time = Signal(32)
+        self.sync.pix += [
+            last_locked.eq(chan.locked),
+            If(chan.locked & ~last_locked,
+                alignments.eq(alignments+1),
+                relock.eq(1),
+                If(relock & ~chan.seeded,
+                    retrains.eq(retrains+1)
+                )
+            ),
+            If(chan.symbol_error,
+                symbol_errors.eq(symbol_errors+1)
+            ),
+            If(~chan.locked,
+                locked_time.eq(0)
+            ).Elif(tick,
+                locked_time.eq(locked_time+1)
+            )
+        ]
+
+        for value, csr in [(chan.locked, self._locked),
+                           (chan.delay_count, self._delay_count),
+                           (chan.word_offset, self._word_offset),
+                           (chan.signal_quality, self._signal_quality),
+                           (alignments, self._alignments),
+                           (symbol_errors, self._symbol_errors),
+                           (locked_time, self._locked_time),
+                           (chan.lock_cycles, self._lock_cycles),
+                           (chan.seeded, self._seeded),
+                           (retrains, self._retrains)]:
+            _add_snapshot(self, update, value, csr)
+
+
+class LinkStatus(Module, AutoCSR):
+    def __init__(self, hdmi, tick_bits=10):
+        self._update = CSR()
+        self._pix_clock = CSRStatus(len(hdmi.frequency.value))
+        self._frames = CSRStatus(32)
+        self._lines = CSRStatus(32)
+        self._bonded = CSRStatus()
+        self._bonding_overflows = CSRStatus(16)
+
+        # # #
+
+        # writing update latches all counters, locked_time counts 2**tick_bits pix cycles
+        update = PulseSynchronizer("sys", "pix")
+        self.submodules += update
+        self.comb += update.i.eq(self._update.re)
+
+        prescaler = Signal(tick_bits)
+        tick = Signal()
+        self.sync.pix += prescaler.eq(prescaler+1)
+        self.comb += tick.eq(prescaler == 0)
+
+        for i, chan in enumerate(hdmi.channels):
+            setattr(self.submodules, "chan" + str(i), ChannelStatus(chan, update.o, tick))
+
+        pixels = hdmi.pixels
+        last_vsync = Signal()
+        last_de = Signal()
+        vsync_seen = Signal()
+        frames = Signal(32)
+        lines = Signal(32)
+        self.sync.pix += If(pixels.valid,
+            last_vsync.eq(pixels.vsync),
+            last_de.eq(pixels.de),
+            If(pixels.vsync != last_vsync,
+                vsync_seen.eq(1)
+            ),
+            If(pixels.de & ~last_de,
+                vsync_seen.eq(0),
+                lines.eq(lines+1),
+                If(vsync_seen,
+                    frames.eq(frames+1)
+                )
+            )
+        )
+        _add_snapshot(self, update.o, frames, self._frames)
+        _add_snapshot(self, update.o, lines, self._lines)
+
+        # lane skew beyond what channel bonding absorbs
+        bonding_overflows = Signal(16)
+        self.sync.pix += If(hdmi.bonding.overflow, bonding_overflows.eq(bonding_overflows+1))
+        _add_snapshot(self, update.o, hdmi.bonding.synced, self._bonded)
+        _add_snapshot(self, update.o, bonding_overflows, self._bonding_overflows)
+        self.comb += self._pix_clock.status.eq(hdmi.frequency.value)
+
+
+class LatencyProbe(Module, AutoCSR):
+    def __init__(self, start, end, width=16):
+        self._latency = CSRStatus(width)
+        self._latency_max = CSRStatus(width)
+        self._budget = CSRStorage(width, reset=2**width-1)
+        self._over_budget = CSRStatus(32)
+        self._measurements = CSRStatus(32)
+
+        # # #
+
+        # start and end are pix strobes marking the same event (e.g. a vsync
+        # edge) on both sides of the pipeline, the delay is in pix cycles
+        budget = Signal(width)
+        self.specials += MultiReg(self._budget.storage, budget, "pix")
+
+        counter = Signal(width)
+        pending = Signal()
+        latency = Signal(width)
+        latency_max = Signal(width)
+        over_budget = Signal(32)
+        measurements = Signal(32)
+        self.sync.pix += [
+            If(start,
+                pending.eq(1),
+                counter.eq(1)
+            ).Elif(pending & (counter != 2**width-1),
+                counter.eq(counter+1)
+            ),
+            If(end & pending & ~start,
+                pending.eq(0),
+                latency.eq(counter),
+                If(counter > latency_max,
+                    latency_max.eq(counter)
+                ),
+                If(counter > budget,
+                    over_budget.eq(over_budget+1)
+                ),
+                measurements.eq(measurements+1)
+            )
+        ]
+
+        # results change once per event, well apart from host reads
+        self.specials += [
+            MultiReg(latency, self._latency.status),
+            MultiReg(latency_max, self._latency_max.status),
+            MultiReg(over_budget, self._over_budget.status),
+            MultiReg(measurements, self._measurements.status)
+        ]
+
+
+class PRBS7Generator(Module):
+    def __init__(self, n=10):
+        self.o = Signal(n)
+
+        # # #
+
+        # x^7 + x^6 + 1, n bits per cycle, bit 0 first on the wire
+        state = Signal(7, reset=0x7f)
+        bits = [state[i] for i in range(7)]
+        for i in range(n):
+            bits.append(bits[-7] ^ bits[-6])
+        self.sync += [
+            self.o.eq(Cat(*bits[7:])),
+            state.eq(Cat(*bits[-7:]))
+        ]
+
+
+class PRBS7Checker(Module):
+    def __init__(self, n=10):
+        self.i = Signal(n)
+        self.errors = Signal(max=n+1)
+
+        # # #
+
+        # self synchronizing: every bit is predicted from the 7 received before
+        # it, so neither the word alignment nor the idelay tap matter. a single
+        # bit error is counted 3 times (the bit itself and the 2 it predicts).
+        last = Signal(n)
+        error_bits = Signal(n)
+        bits = Cat(last, self.i)
+        self.sync += [
+            last.eq(self.i),
+            error_bits.eq(Cat(*[bits[n+k] ^ bits[n+k-7] ^ bits[n+k-6] for k in range(n)])),
+            self.errors.eq(reduce(add, [error_bits[k] for k in range(n)]))
+        ]
+
+
+class BERTester(Module, AutoCSR):
+    def __init__(self, channels, settle=16):
+        nlanes = len(channels)
+        ntaps = 32
+
+        self._enable = CSRStorage()
+        self._tap = CSRStorage(5)
+        self._update = CSR()
+        self._clear = CSR()
+        self._cycles = CSRStatus(48)
+        for i in range(nlanes):
+            csr = CSRStatus(32, name="lane{}_errors".format(i))
+            setattr(self, "_lane{}_errors".format(i), csr)
+
+        self._sweep_start = CSR()
+        self._sweep_window = CSRStorage(5, reset=20)
+        self._sweep_done = CSRStatus()
+        self._sweep_lane = CSRStorage(bits_for(nlanes-1))
+        self._sweep_tap = CSRStorage(5)
+        self._sweep_errors = CSRStatus(32)
+
+        # # #
+
+        # while enabled the idelay taps of the channels are driven from here,
+        # either the static tap or the one being swept
+        enable = Signal()
+        tap = Signal(5)
+        window = Signal(5)
+        self.specials += [
+            MultiReg(self._enable.storage, enable, "pix"),
+            MultiReg(self._tap.storage, tap, "pix"),
+            MultiReg(self._sweep_window.storage, window, "pix")
+        ]
+        update = PulseSynchronizer("sys", "pix")
+        clear = PulseSynchronizer("sys", "pix")
+        start = PulseSynchronizer("sys", "pix")
+        self.submodules += update, clear, start
+        self.comb += [
+            update.i.eq(self._update.re),
+            clear.i.eq(self._clear.re),
+            start.i.eq(self._sweep_start.re)
+        ]
+
+        sweeping = Signal()
+        sweep_tap = Signal(5)
+        sweep_done = Signal()
+        for chan in channels:
+            self.comb += [
+                chan.manual_delay.eq(enable | sweeping),
+                chan.manual_delay_count.eq(Mux(sweeping, sweep_tap, tap))
+            ]
+
+        checkers = [PRBS7Checker() for chan in channels]
+        self.submodules += [ClockDomainsRenamer("pix")(checker) for checker in checkers]
+        self.comb += [checker.i.eq(chan.deserialiser.data) for checker, chan in zip(checkers, channels)]
+
+        # live counters, at the static tap
+        cycles = Signal(48)
+        self.sync.pix += If(clear.o,
+                cycles.eq(0)
+            ).Elif(enable & ~sweeping,
+                cycles.eq(cycles+1)
+            )
+        _add_snapshot(self, update.o, cycles, self._cycles)
+        for i, checker in enumerate(checkers):
+            errors = Signal(32)
+            self.sync.pix += If(clear.o,
+                    errors.eq(0)
+                ).Elif(enable & ~sweeping,
+                    errors.eq(errors + checker.errors)
+                )
+            _add_snapshot(self, update.o, errors, getattr(self, "_lane{}_errors".format(i)))
+
+        # eye sweep: errors in 2**window pix cycles at every tap, for all lanes
+        # at once, stored in a margin map per lane
+        settle_timer = WaitTimer(settle)
+        self.submodules += ClockDomainsRenamer("pix")(settle_timer)
+        count = Signal(32)
+        counts = []
+        write_ports = []
+        read_ports = []
+        for checker in checkers:
+            acc = Signal(32)
+            margin_map = Memory(32, ntaps)
+            write_port = margin_map.get_port(write_capable=True, clock_domain="pix")
+            read_port = margin_map.get_port(clock_domain="sys")
+            self.specials += margin_map, write_port, read_port
+            self.comb += [
+                write_port.adr.eq(sweep_tap),
+                write_port.dat_w.eq(acc),
+                read_port.adr.eq(self._sweep_tap.storage)
+            ]
+            counts.append((acc, checker.errors))
+            write_ports.append(write_port)
+            read_ports.append(read_port)
+        self.comb += self._sweep_errors.status.eq(Array(port.dat_r for port in read_ports)[self._sweep_lane.storage])
+
+        fsm = FSM(reset_state="IDLE")
+        self.submodules.sweep_fsm = ClockDomainsRenamer("pix")(fsm)
+        fsm.act("IDLE",
+            If(start.o,
+                NextValue(sweep_tap, 0),
+                NextValue(sweep_done, 0),
+                NextState("SETTLE")
+            )
+        )
+        fsm.act("SETTLE",
+            sweeping.eq(1),
+            settle_timer.wait.eq(1),
+            NextValue(count, 0),
+            [NextValue(acc, 0) for acc, errors in counts],
+            If(settle_timer.done,
+                NextState("COUNT")
+            )
+        )
+        fsm.act("COUNT",
+            sweeping.eq(1),
+            If(Array(count[i] for i in range(32))[window],
+                NextState("STORE")
+            ).Else(
+                NextValue(count, count+1),
+                [NextValue(acc, acc + errors) for acc, errors in counts]
+            )
+        )
+        fsm.act("STORE",
+            sweeping.eq(1),
+            [port.we.eq(1) for port in write_ports],
+            NextValue(sweep_tap, sweep_tap+1),
+            If(sweep_tap == ntaps-1,
+                NextValue(sweep_done, 1),
+                NextState("IDLE")
+            ).Else(
+                NextState("SETTLE")
+            )
+        )
+        self.specials += MultiReg(sweep_done, self._sweep_done.status)
+
+
+class TimingGenerator(Module, AutoCSR):
+    def __init__(self, timing, genlock_lines=2):
+        self.genlock = Signal()
+
+        self.x = Signal(12)
+        self.y = Signal(12)
+        self.de = Signal()
+        self.hsync = Signal()
+        self.vsync = Signal()
+        self.new_frame = Signal()
+
+        fields = [name for name in tmds.VideoTiming._fields if name != "pix_clk"]
+        for name in fields:
+            setattr(self, "_" + name, CSRStorage(1 if name.endswith("_pol") else 12,
+                                                 reset=getattr(timing, name), name=name))
+
+        # # #
+
+        # output timing, x and y count from the first active pixel. genlock
+        # restarts the frame genlock_lines lines before the first active one.
+        t = {}
+        for name in fields:
+            storage = getattr(self, "_" + name).storage
+            t[name] = Signal(len(storage), reset=getattr(timing, name))
+            self.specials += MultiReg(storage, t[name], "pix")
+
+        self.sync.pix += \
+            If(self.genlock,
+                self.x.eq(0),
+                self.y.eq(t["vscan"] - genlock_lines)
+            ).Elif(self.x == t["hscan"] - 1,
+                self.x.eq(0),
+                If(self.y == t["vscan"] - 1,
+                    self.y.eq(0)
+                ).Else(
+                    self.y.eq(self.y + 1)
+                )
+            ).Else(
+                self.x.eq(self.x + 1)
+            )
+        self.comb += [
+            self.de.eq((self.x < t["hactive"]) & (self.y < t["vactive"])),
+            self.hsync.eq(((self.x >= t["hsync_start"]) & (self.x < t["hsync_end"])) == t["hsync_pol"]),
+            self.vsync.eq(((self.y >= t["vsync_start"]) & (self.y < t["vsync_end"])) == t["vsync_pol"]),
+            self.new_frame.eq((self.x == 0) & (self.y == t["vscan"] - 1))
+        ]
+
+
+class LayerWriter(Module):
+    def __init__(self, pixels, width, height, scale=1, wrap=False):
+        self.valid = Signal()
+        self.frame_start = Signal()
+
+        self.adr = Signal(max=width*height)
+        self.dat = Signal(24)
+        self.we = Signal()
+
+        # # #
+
+        # keeps one pixel out of scale in both directions, rows of width pixels
+        # from the first line after vsync. with wrap the rows are a ring of
+        # height lines, otherwise the rest of the frame is dropped.
+        shift = log2_int(scale)
+        pixel = Record(pixel_layout)
+        self.sync.pix += pixel.eq(pixels)
+
+        vsync_seen = Signal()
+        de_rise = Signal()
+        line = Signal(12)
+        next_line = Signal(12)
+        x = Signal(12)
+        row = Signal(max=height+1)
+        row_base = Signal(max=width*(height+1))
+        self.comb += [
+            de_rise.eq(pixels.valid & pixels.de & ~pixel.de),
+            self.frame_start.eq(de_rise & vsync_seen),
+            next_line.eq(line + 1)
+        ]
+
+        if wrap:
+            next_row = If(row == height-1,
+                    row.eq(0),
+                    row_base.eq(0)
+                ).Else(
+                    row.eq(row + 1),
+                    row_base.eq(row_base + width)
+                )
+        else:
+            next_row = If(row != height,
+                    row.eq(row + 1),
+                    row_base.eq(row_base + width)
+                )
+        self.sync.pix += [
+            self.valid.eq(pixels.valid),
+            If(pixels.valid & (pixels.vsync != pixel.vsync),
+                vsync_seen.eq(1)
+            ),
+            If(de_rise,
+                If(vsync_seen,
+                    vsync_seen.eq(0),
+                    line.eq(0),
+                    row.eq(0),
+                    row_base.eq(0)
+                ).Else(
+                    line.eq(next_line),
+                    If(next_line[:shift] == 0, next_row) if shift else next_row
+                )
+            ),
+            If(pixel.valid & pixel.de,
+                x.eq(x + 1)
+            ).Else(
+                x.eq(0)
+            )
+        ]
+
+        keep = pixel.valid & pixel.de & (row < height) & (x[shift:] < width)
+        if shift:
+            keep = keep & (line[:shift] == 0) & (x[:shift] == 0)
+        self.comb += [
+            self.adr.eq(row_base + x[shift:]),
+            self.dat.eq(Cat(pixel.r, pixel.g, pixel.b)),
+            self.we.eq(keep)
+        ]
+
+
+# compositor layers take the output position (x, y, de, new_frame) and give
+# the color (r in the low bits) and visibility of that pixel one cycle later
+
+class LineBufferLayer(Module):
+    def __init__(self, pixels, clock_domain="pix", width=1920, nlines=4):
+        self.x = Signal(12)
+        self.y = Signal(12)
+        self.de = Signal()
+        self.new_frame = Signal()
+        self.visible = Signal()
+        self.color = Signal(24)
+
+        self.genlock = Signal()
+
+        # # #
+
+        # full size layer through a ring of nlines lines. the output timing is
+        # genlocked to it, so that each line is read a couple of lines after
+        # it was written.
+        writer = ClockDomainsRenamer({"pix": clock_domain})(LayerWriter(pixels, width, nlines, wrap=True))
+        self.submodules += writer
+
+        storage = Memory(24, width*nlines)
+        wrport = storage.get_port(write_capable=True, clock_domain=clock_domain)
+        rdport = storage.get_port(clock_domain="pix")
+        self.specials += storage, wrport, rdport
+        self.comb += [
+            wrport.adr.eq(writer.adr),
+            wrport.dat_w.eq(writer.dat),
+            wrport.we.eq(writer.we)
+        ]
+
+        frame_start = PulseSynchronizer(clock_domain, "pix")
+        present = Signal()
+        self.submodules += frame_start
+        self.specials += MultiReg(writer.valid, present, "pix")
+        self.comb += [
+            frame_start.i.eq(writer.frame_start),
+            self.genlock.eq(frame_start.o)
+        ]
+
+        inside = Signal()
+        last_inside = Signal()
+        col = Signal(max=width)
+        row_base = Signal(max=width*nlines)
+        self.comb += [
+            inside.eq(self.de & (self.x < width)),
+            rdport.adr.eq(row_base + col),
+            self.color.eq(rdport.dat_r)
+        ]
+        self.sync.pix += [
+            last_inside.eq(inside),
+            If(inside,
+                col.eq(col + 1)
+            ).Else(
+                col.eq(0)
+            ),
+            If(self.new_frame,
+                row_base.eq(0)
+            ).Elif(last_inside & ~inside,
+                If(row_base == width*(nlines-1),
+                    row_base.eq(0)
+                ).Else(
+                    row_base.eq(row_base + width)
+                )
+            ),
+            self.visible.eq(inside & present)
+        ]
+
+
+class InsetLayer(Module, AutoCSR):
+    def __init__(self, pixels, clock_domain, width, height, scale=4, nbuffers=3, x=0, y=0):
+        self.x = Signal(12)
+        self.y = Signal(12)
+        self.de = Signal()
+        self.new_frame = Signal()
+        self.visible = Signal()
+        self.color = Signal(24)
+
+        # blending, in the output domain
+        self.alpha = Signal(9)
+        self.key_enable = Signal()
+        self.key = Signal(24)
+
+        self._x = CSRStorage(12, reset=x)
+        self._y = CSRStorage(12, reset=y)
+        self._alpha = CSRStorage(9, reset=256)
+        self._key_enable = CSRStorage()
+        self._key = CSRStorage(24)
+
+        # # #
+
+        # the input downscaled by scale into frame buffers of width x height.
+        # the writer starts each frame in a buffer that is neither displayed
+        # nor the latest complete one (dropping the frame if there is none),
+        # the reader switches to the latest complete one at its frame start.
+        # with 3 buffers no input frame is dropped and nothing tears whatever
+        # the input and output frame rates. the buffer numbers are all owned by
+        # the writer domain: at its frame start the reader requests a buffer
+        # and the writer grants it the latest complete one, which the reader
+        # only samples on the grant, once it is stable.
+        size = width*height
+        writer = ClockDomainsRenamer({"pix": clock_domain})(LayerWriter(pixels, width, height, scale))
+        self.submodules += writer
+
+        storage = Memory(24, nbuffers*size)
+        wrport = storage.get_port(write_capable=True, clock_domain=clock_domain)
+        rdport = storage.get_port(clock_domain="pix")
+        self.specials += storage, wrport, rdport
+
+        wbuf = Signal(max=nbuffers)
+        writing = Signal()
+        complete = Signal(max=nbuffers)
+        complete_valid = Signal()
+        latest = Signal(max=nbuffers)
+        latest_valid = Signal()
+        displayed = Signal(max=nbuffers)
+        displayed_valid = Signal()
+        shown = Signal(max=nbuffers)
+        request = PulseSynchronizer("pix", clock_domain)
+        grant = PulseSynchronizer(clock_domain, "pix")
+        self.submodules += request, grant
+        self.comb += [
+            latest.eq(Mux(writing, wbuf, complete)),
+            latest_valid.eq(writing | complete_valid),
+            shown.eq(Mux(request.o & complete_valid, complete, displayed)),
+            wrport.adr.eq(wbuf*size + writer.adr),
+            wrport.dat_w.eq(writer.dat),
+            wrport.we.eq(writer.we & writing)
+        ]
+        sync = getattr(self.sync, clock_domain)
+        sync += [
+            If(request.o & complete_valid,
+                displayed.eq(complete),
+                displayed_valid.eq(1)
+            ),
+            grant.i.eq(request.o),
+            If(writer.frame_start,
+                complete.eq(latest),
+                complete_valid.eq(latest_valid),
+                writing.eq(0),
+                [If((i != shown) & ~(latest_valid & (i == latest)),
+                    wbuf.eq(i),
+                    writing.eq(1)
+                 ) for i in reversed(range(nbuffers))]
+            )
+        ]
+
+        rbuf = Signal(max=nbuffers)
+        ready = Signal()
+        present = Signal()
+        x0 = Signal(12)
+        y0 = Signal(12)
+        self.specials += [
+            MultiReg(writer.valid, present, "pix"),
+            MultiReg(self._x.storage, x0, "pix"),
+            MultiReg(self._y.storage, y0, "pix"),
+            MultiReg(self._alpha.storage, self.alpha, "pix"),
+            MultiReg(self._key_enable.storage, self.key_enable, "pix"),
+            MultiReg(self._key.storage, self.key, "pix")
+        ]
+
+        inside = Signal()
+        last_inside = Signal()
+        col = Signal(max=width)
+        row_base = Signal(max=size)
+        self.comb += [
+            inside.eq((self.x >= x0) & (self.x < x0 + width) &
+                      (self.y >= y0) & (self.y < y0 + height)),
+            rdport.adr.eq(rbuf*size + row_base + col),
+            self.color.eq(rdport.dat_r)
+        ]
+        self.comb += request.i.eq(self.new_frame)
+        self.sync.pix += [
+            If(grant.o,
+                rbuf.eq(displayed),
+                ready.eq(displayed_valid)
+            ),
+            last_inside.eq(inside),
+            If(inside,
+                col.eq(col + 1)
+            ).Else(
+                col.eq(0)
+            ),
+            If(self.new_frame,
+                row_base.eq(0)
+            ).Elif(last_inside & ~inside,
+                row_base.eq(row_base + width)
+            ),
+            self.visible.eq(inside & ready & present)
+        ]
+
+
+class Compositor(Module, AutoCSR):
+    def __init__(self, background, insets=(), timing=tmds.video_timings["1920x1080@60"]):
+        self.source = Record(pixel_layout)
+
+        self._genlock = CSRStorage(reset=1)
+
+        # # #
+
+        # one output timing generator in pix, genlocked to the background.
+        # insets are blended over it in order, one pipeline stage each:
+        # color = (alpha*inset + (256 - alpha)*below)/256, except on the key
+        # color when keying is enabled.
+        self.submodules.generator = generator = TimingGenerator(timing)
+        self.submodules.background = background
+        for i, inset in enumerate(insets):
+            setattr(self.submodules, "inset" + str(i), inset)
+
+        genlock = Signal()
+        self.specials += MultiReg(self._genlock.storage, genlock, "pix")
+        self.comb += generator.genlock.eq(genlock & background.genlock)
+        for layer in [background] + list(insets):
+            self.comb += [
+                layer.x.eq(generator.x),
+                layer.y.eq(generator.y),
+                layer.de.eq(generator.de),
+                layer.new_frame.eq(generator.new_frame)
+            ]
+
+        color = Signal(24)
+        self.comb += If(background.visible, color.eq(background.color))
+        for i, inset in enumerate(insets):
+            fg = inset.color
+            visible = inset.visible
+            for j in range(i):
+                fg_delayed = Signal(24)
+                visible_delayed = Signal()
+                self.sync.pix += [
+                    fg_delayed.eq(fg),
+                    visible_delayed.eq(visible)
+                ]
+                fg, visible = fg_delayed, visible_delayed
+
+            opaque = Signal()
+            beta = Signal(9)
+            blended = Signal(24)
+            self.comb += [
+                opaque.eq(visible & ~(inset.key_enable & (fg == inset.key))),
+                beta.eq(256 - inset.alpha)
+            ]
+            self.sync.pix += \
+                If(opaque,
+                    [blended[8*c:8*c+8].eq((fg[8*c:8*c+8]*inset.alpha + color[8*c:8*c+8]*beta) >> 8)
+                        for c in range(3)]
+                ).Else(
+                    blended.eq(color)
+                )
+            color = blended
+
+        syncs = Cat(generator.de, generator.hsync, generator.vsync)
+        for i in range(1 + len(insets)):
+            syncs_delayed = Signal(3)
+            self.sync.pix += syncs_delayed.eq(syncs)
+            syncs = syncs_delayed
+        self.sync.pix += [
+            self.source.valid.eq(1),
+            Cat(self.source.de, self.source.hsync, self.source.vsync).eq(syncs),
+            Cat(self.source.r, self.source.g, self.source.b).eq(color)
+        ]
+
+
+# edid of the original design, 1080p preferred
+edid_rom = [
+    0x00, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0x00,
+    0x04, 0x43, 0x07, 0xf2, 0x01, 0x00, 0x00, 0x00,
+    0xff, 0x11, 0x01, 0x04, 0xa2, 0x4f, 0x00, 0x78,
+    0x3e, 0xee, 0x91, 0xa3, 0x54, 0x4c, 0x99, 0x26,
+    0x0f, 0x50, 0x54, 0x20, 0x00, 0x00, 0x01, 0x01,
+    0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01,
+    0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x02, 0x3a,
+    0x80, 0x18, 0x71, 0x38, 0x2d, 0x40, 0x58, 0x2c,
+    0x04, 0x05, 0x0f, 0x48, 0x42, 0x00, 0x00, 0x1e,
+    0x01, 0x1d, 0x80, 0x18, 0x71, 0x1c, 0x16, 0x20,
+    0x58, 0x2c, 0x25, 0x00, 0x0f, 0x48, 0x42, 0x00,
+    0x00, 0x9e, 0x01, 0x1d, 0x00, 0x72, 0x51, 0xd0,
+    0x1e, 0x20, 0x6e, 0x28, 0x55, 0x00, 0x0f, 0x48,
+    0x42, 0x00, 0x00, 0x1e, 0x00, 0x00, 0x00, 0xfc,
+    0x00, 0x48, 0x61, 0x6d, 0x73, 0x74, 0x65, 0x72,
+    0x6b, 0x73, 0x0a, 0x20, 0x20, 0x20, 0x01, 0x74,
+    0x02, 0x03, 0x18, 0x72, 0x47, 0x90, 0x85, 0x04,
+    0x03, 0x02, 0x07, 0x06, 0x23, 0x09, 0x07, 0x07,
+    0x83, 0x01, 0x00, 0x00, 0x65, 0x03, 0x0c, 0x00,
+    0x10, 0x00, 0x8e, 0x0a, 0xd0, 0x8a, 0x20, 0xe0,
+    0x2d, 0x10, 0x10, 0x3e, 0x96, 0x00, 0x1f, 0x09,
+    0x00, 0x00, 0x00, 0x18, 0x8e, 0x0a, 0xd0, 0x8a,
+    0x20, 0xe0, 0x2d, 0x10, 0x10, 0x3e, 0x96, 0x00,
+    0x04, 0x03, 0x00, 0x00, 0x00, 0x18, 0x8e, 0x0a,
+    0xa0, 0x14, 0x51, 0xf0, 0x16, 0x00, 0x26, 0x7c,
+    0x43, 0x00, 0x1f, 0x09, 0x00, 0x00, 0x00, 0x98,
+    0x8e, 0x0a, 0xa0, 0x14, 0x51, 0xf0, 0x16, 0x00,
+    0x26, 0x7c, 0x43, 0x00, 0x04, 0x03, 0x00, 0x00,
+    0x00, 0x98, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xc9,
+]
+
+
+class HDMIIn(Module):
+    def __init__(self, pads, gearbox=False, edid=edid_rom):
+        self.source = self.pixels = Record(pixel_layout)
+
+        # # #
+
+        # the idelays use the IDELAYCTRL of _CRG, shared by all the inputs.
+        # extra inputs get their own clock domains through ClockDomainsRenamer,
+        # see hdmi_in_clock_domains.
 
         # input buffers
         hdmi_in_clk = Signal()
         hdmi_in_data = Signal(3)
 
-        self.specials += [
-            Instance("IBUFDS",
-                i_I=hdmi_in_pads.clk_p,
-                i_IB=hdmi_in_pads.clk_n,
-                o_O=hdmi_in_clk),
-            Instance("IBUFDS",
-                i_I=hdmi_in_pads.data0_p,
-                i_IB=hdmi_in_pads.data0_n,
-                o_O=hdmi_in_data[0]),
-            Instance("IBUFDS",
-                i_I=hdmi_in_pads.data1_p,
-                i_IB=hdmi_in_pads.data1_n,
-                o_O=hdmi_in_data[1]),
-            Instance("IBUFDS",
-                i_I=hdmi_in_pads.data2_p,
-                i_IB=hdmi_in_pads.data2_n,
-                o_O=hdmi_in_data[2]),
-        ]
+        self.specials += Instance("IBUFDS",
+            i_I=pads.clk_p,
+            i_IB=pads.clk_n,
+            o_O=hdmi_in_clk)
+        for i in range(3):
+            self.specials += Instance("IBUFDS",
+                i_I=getattr(pads, "data{}_p".format(i)),
+                i_IB=getattr(pads, "data{}_n".format(i)),
+                o_O=hdmi_in_data[i])
 
         # edid
-        edid_rom = [
-            0x00, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff, 0x00,
-            0x04, 0x43, 0x07, 0xf2, 0x01, 0x00, 0x00, 0x00,
-            0xff, 0x11, 0x01, 0x04, 0xa2, 0x4f, 0x00, 0x78,
-            0x3e, 0xee, 0x91, 0xa3, 0x54, 0x4c, 0x99, 0x26,
-            0x0f, 0x50, 0x54, 0x20, 0x00, 0x00, 0x01, 0x01,
-            0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01,
-            0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x02, 0x3a,
-            0x80, 0x18, 0x71, 0x38, 0x2d, 0x40, 0x58, 0x2c,
-            0x04, 0x05, 0x0f, 0x48, 0x42, 0x00, 0x00, 0x1e,
-            0x01, 0x1d, 0x80, 0x18, 0x71, 0x1c, 0x16, 0x20,
-            0x58, 0x2c, 0x25, 0x00, 0x0f, 0x48, 0x42, 0x00,
-            0x00, 0x9e, 0x01, 0x1d, 0x00, 0x72, 0x51, 0xd0,
-            0x1e, 0x20, 0x6e, 0x28, 0x55, 0x00, 0x0f, 0x48,
-            0x42, 0x00, 0x00, 0x1e, 0x00, 0x00, 0x00, 0xfc,
-            0x00, 0x48, 0x61, 0x6d, 0x73, 0x74, 0x65, 0x72,
-            0x6b, 0x73, 0x0a, 0x20, 0x20, 0x20, 0x01, 0x74,
-            0x02, 0x03, 0x18, 0x72, 0x47, 0x90, 0x85, 0x04,
-            0x03, 0x02, 0x07, 0x06, 0x23, 0x09, 0x07, 0x07,
-            0x83, 0x01, 0x00, 0x00, 0x65, 0x03, 0x0c, 0x00,
-            0x10, 0x00, 0x8e, 0x0a, 0xd0, 0x8a, 0x20, 0xe0,
-            0x2d, 0x10, 0x10, 0x3e, 0x96, 0x00, 0x1f, 0x09,
-            0x00, 0x00, 0x00, 0x18, 0x8e, 0x0a, 0xd0, 0x8a,
-            0x20, 0xe0, 0x2d, 0x10, 0x10, 0x3e, 0x96, 0x00,
-            0x04, 0x03, 0x00, 0x00, 0x00, 0x18, 0x8e, 0x0a,
-            0xa0, 0x14, 0x51, 0xf0, 0x16, 0x00, 0x26, 0x7c,
-            0x43, 0x00, 0x1f, 0x09, 0x00, 0x00, 0x00, 0x98,
-            0x8e, 0x0a, 0xa0, 0x14, 0x51, 0xf0, 0x16, 0x00,
-            0x26, 0x7c, 0x43, 0x00, 0x04, 0x03, 0x00, 0x00,
-            0x00, 0x98, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
-            0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0xc9,
-        ]
-        self.submodules.edid = EDID(hdmi_in_pads, edid_rom)
+        self.submodules.edid = EDID(pads, edid)
+        self.comb += [
+            pads.hpa.eq(1),
+            pads.txen.eq(1)
+        ]
+
+        # pixel clock measurement
+        self.clock_domains.cd_pix_in = ClockDomain("pix_in", reset_less=True)
+        self.specials += Instance("BUFG", i_I=hdmi_in_clk, o_O=self.cd_pix_in.clk)
+        self.submodules.frequency = FrequencyMeter()
+
+        # mmcm, reprogrammed through the drp when the pixel clock changes band
+        configs = [mmcm_drp_config(divclk, 40//divclk, 8//divclk, 80//divclk) for limit, divclk in pix_clock_bands]
+        self.submodules.mmcm_reconfig = reconfig = MMCMReconfig(configs)
+
+        nbands = len(pix_clock_bands)
+        band = Signal(max=nbands)
+        current_band = Signal(max=nbands, reset=nbands-1)
+        self.comb += band.eq(nbands-1)
+        for i, (limit, divclk) in reversed(list(enumerate(pix_clock_bands[:-1]))):
+            self.comb += If(self.frequency.value < limit, band.eq(i))
+
+        outside = Signal()
+        outside_cases = {}
+        for i in range(nbands):
+            low, high = pix_clock_band_range(i)
+            conditions = []
+            if low is not None:
+                conditions.append(self.frequency.value < low)
+            if high is not None:
+                conditions.append(self.frequency.value >= high)
+            outside_cases[i] = outside.eq(reduce(or_, conditions))
+        self.comb += Case(current_band, outside_cases)
+
+        new_band = Signal(max=nbands)
+        measurements = Signal(max=pix_clock_band_measurements+1)
         self.comb += [
-            hdmi_in_pads.hpa.eq(1),
-            hdmi_in_pads.txen.eq(1)
+            reconfig.config.eq(new_band),
+            reconfig.start.eq((measurements == pix_clock_band_measurements) & ~reconfig.busy)
+        ]
+        self.sync += [
+            If(reconfig.start,
+                current_band.eq(new_band),
+                measurements.eq(0)
+            ).Elif(self.frequency.valid,
+                If(~outside,
+                    measurements.eq(0)
+                ).Elif((band != new_band) | (measurements == 0),
+                    new_band.eq(band),
+                    measurements.eq(1)
+                ).Elif(measurements != pix_clock_band_measurements,
+                    measurements.eq(measurements+1)
+                )
+            )
         ]
 
-        # mmcm
         pix_clk_pll = Signal()
         pix5x_clk_pll = Signal()
+        pix_div2_clk_pll = Signal()
         pix_clk = Signal()
         pix5x_clk = Signal()
         mmcm_fb = Signal()
         mmcm_locked = Signal()
         self.specials += [
             Instance("MMCME2_ADV",
-                p_BANDWIDTH="OPTIMIZED", i_RST=0, o_LOCKED=mmcm_locked,
+                p_BANDWIDTH="OPTIMIZED", i_RST=reconfig.mmcm_reset, o_LOCKED=mmcm_locked,
 
-                # VCO
-                p_REF_JITTER1=0.01, p_CLKIN1_PERIOD=6.7,
-                p_CLKFBOUT_MULT_F=5.0, p_CLKFBOUT_PHASE=0.000, p_DIVCLK_DIVIDE=1,
-                i_CLKIN1=hdmi_in_clk, i_CLKFBIN=mmcm_fb, o_CLKFBOUT=mmcm_fb,
+                # VCO, the static settings are those of the highest band
+                p_REF_JITTER1=0.01, p_CLKIN1_PERIOD=6.06,
+                p_CLKFBOUT_MULT_F=40.0, p_CLKFBOUT_PHASE=0.000, p_DIVCLK_DIVIDE=8,
+                i_CLKIN1=self.cd_pix_in.clk, i_CLKFBIN=mmcm_fb, o_CLKFBOUT=mmcm_fb,
 
                 # CLK0
                 p_CLKOUT0_DIVIDE_F=5.0, p_CLKOUT0_PHASE=0.000, o_CLKOUT0=pix_clk_pll,
                 # CLK1
-                p_CLKOUT1_DIVIDE=1, p_CLKOUT1_PHASE=0.000, o_CLKOUT1=pix5x_clk_pll
+                p_CLKOUT1_DIVIDE=1, p_CLKOUT1_PHASE=0.000, o_CLKOUT1=pix5x_clk_pll,
+                # CLK2
+                p_CLKOUT2_DIVIDE=10, p_CLKOUT2_PHASE=0.000, o_CLKOUT2=pix_div2_clk_pll,
+
+                # DRP
+                i_DCLK=ClockSignal(), i_DEN=reconfig.drp_en, i_DWE=reconfig.drp_we,
+                i_DADDR=reconfig.drp_addr, i_DI=reconfig.drp_di,
+                o_DO=reconfig.drp_do, o_DRDY=reconfig.drp_rdy
             ),
             Instance("BUFG", i_I=pix_clk_pll, o_O=pix_clk),
             Instance("BUFIO", i_I=pix5x_clk_pll, o_O=pix5x_clk),
@@ -459,26 +2452,33 @@ class HDMILoopback(Module):
         self.comb += self.cd_pix.clk.eq(pix_clk)
         self.comb += self.cd_pix5x.clk.eq(pix5x_clk)
 
+        if gearbox:
+            # half rate domain, edge aligned with pix
+            self.clock_domains.cd_pix_div2 = ClockDomain("pix_div2")
+            self.specials += Instance("BUFG", i_I=pix_div2_clk_pll, o_O=self.cd_pix_div2.clk)
+            self.comb += self.cd_pix_div2.rst.eq(self.cd_pix.rst)
+
         reset_timer = WaitTimer(256)
         self.submodules += reset_timer
         self.comb += reset_timer.wait.eq(mmcm_locked)
 
-        # hdmi input
-        ctl_valid = Signal(3)
-        ctl = [Signal(2) for i in range(3)]
-        data_valid = Signal(3)
-        data = [Signal(8) for i in range(3)]
+        # channels
+        self.submodules.bonding = bonding = ChannelBonding()
+        locked = Signal(3)
 
+        self.channels = []
         for i in range(3):
             chan = HDMIInputChannel(hdmi_in_data[i])
             self.submodules += chan
+            self.channels.append(chan)
             self.comb += [
                 chan.reset.eq(~reset_timer.done),
-                ctl_valid[i].eq(chan.ctl_valid),
-                ctl[i].eq(chan.ctl),
-                data_valid[i].eq(chan.data_valid),
-                data[i].eq(chan.data)
+                locked[i].eq(chan.locked),
+                bonding.data_in[i].de.eq(chan.data_valid),
+                bonding.data_in[i].d.eq(chan.data),
+                bonding.data_in[i].c.eq(chan.ctl)
             ]
+        self.comb += bonding.valid_i.eq(locked == 0b111)
 
         blank = Signal()
         hsync = Signal()
@@ -488,43 +2488,260 @@ class HDMILoopback(Module):
         blue  = Signal(8)
 
         self.sync.pix += [
-            If(ctl_valid[0] & ctl_valid[1] & ctl_valid[2],
-                vsync.eq(ctl[0][1]),
-                hsync.eq(ctl[0][0]),
-                blank.eq(1),
-                red.eq(0),
-                green.eq(0),
-                blue.eq(0)
-            ).Elif(data_valid[0] & data_valid[1] & data_valid[2],
-                vsync.eq(0),
-                hsync.eq(0),
-                blank.eq(0),
-                red.eq(data[2]),
-                green.eq(data[1]),
-                blue.eq(data[0])
+            If(bonding.valid,
+                If(~bonding.data_out[0].de,
+                    vsync.eq(bonding.data_out[0].c[1]),
+                    hsync.eq(bonding.data_out[0].c[0]),
+                    blank.eq(1),
+                    red.eq(0),
+                    green.eq(0),
+                    blue.eq(0)
+                ).Else(
+                    vsync.eq(0),
+                    hsync.eq(0),
+                    blank.eq(0),
+                    red.eq(bonding.data_out[2].d),
+                    green.eq(bonding.data_out[1].d),
+                    blue.eq(bonding.data_out[0].d)
+                )
             )
         ]
 
-        # hdmi output
-        self.submodules.hdmi_output_clkgen = S7HDMIOutEncoderSerializer(hdmi_out_pads.clk_p, hdmi_out_pads.clk_n, bypass_encoder=True)
-        self.submodules.hdmi_output = S7HDMIOutPHY(hdmi_out_pads)
+        self.sync.pix += self.pixels.valid.eq(bonding.valid)
+        self.comb += [
+            self.pixels.de.eq(~blank),
+            self.pixels.hsync.eq(hsync),
+            self.pixels.vsync.eq(vsync),
+            self.pixels.r.eq(red),
+            self.pixels.g.eq(green),
+            self.pixels.b.eq(blue)
+        ]
 
+        # latency probe start point: vsync edges on the aligned symbols of
+        # channel 0 (before decoding)
+        self.vsync_in_edge = Signal()
+        vsync_in = Signal()
+        last_vsync_in = Signal()
+        is_control = Signal()
         self.comb += [
-            self.hdmi_output_clkgen.data.eq(Signal(10, reset=0b0000011111)),
-            self.hdmi_output.sink.valid.eq(1),
-            self.hdmi_output.sink.de.eq(~blank),
-            self.hdmi_output.sink.hsync.eq(hsync),
-            self.hdmi_output.sink.vsync.eq(vsync),
-            self.hdmi_output.sink.r.eq(red),
-            self.hdmi_output.sink.g.eq(green),
-            self.hdmi_output.sink.b.eq(blue)
+            is_control.eq(reduce(or_, [self.channels[0].symbol == token for token in control_tokens])),
+            vsync_in.eq((self.channels[0].symbol == control_tokens[2]) |
+                        (self.channels[0].symbol == control_tokens[3])),
+            self.vsync_in_edge.eq(self.channels[0].locked & is_control & (vsync_in != last_vsync_in))
         ]
+        self.sync.pix += \
+            If(is_control,
+                last_vsync_in.eq(vsync_in)
+            )
+
+        if gearbox:
+            self.submodules.gearbox = PixelGearbox()
+            self.comb += self.gearbox.sink.eq(self.pixels)
+            self.pixels2 = self.gearbox.source
+
+
+def hdmi_in_clock_domains(n):
+    # ClockDomainsRenamer mapping for the nth HDMIIn of a design (n > 0)
+    return {cd: cd + str(n) for cd in ["pix_in", "pix", "pix5x", "pix_div2"]}
+
+
+class HDMILoopback(Module):
+    def __init__(self, platform, gearbox=False, prbs=False, compositor=False):
+        self.submodules.crg = _CRG(platform)
+
+        # hdmi input
+        self.submodules.hdmi_in = hdmi_in = HDMIIn(platform.request("hdmi_in"), gearbox)
+        self.frequency = hdmi_in.frequency
+        self.channels = hdmi_in.channels
+        self.bonding = hdmi_in.bonding
+        self.pixels = hdmi_in.pixels
+        if gearbox:
+            self.pixels2 = hdmi_in.pixels2
+        self.vsync_in_edge = hdmi_in.vsync_in_edge
+
+        hdmi_out_pads = platform.request("hdmi_out")
+
+        if compositor:
+            # the input over itself, downscaled by 8 in the top right corner
+            self.submodules.compositor = Compositor(LineBufferLayer(self.pixels),
+                [InsetLayer(self.pixels, "pix", 240, 135, scale=8, x=1632, y=48)])
+            output = self.compositor.source
+        else:
+            output = self.pixels
+
+        # latency probe end point: vsync edges at the output phy
+        self.vsync_out_edge = Signal()
+        last_vsync_out = Signal()
+        self.comb += self.vsync_out_edge.eq(output.vsync != last_vsync_out)
+        self.sync.pix += last_vsync_out.eq(output.vsync)
+
+        # hdmi output
+        if prbs:
+            # prbs7 on all lanes for loopback bit error rate tests. the output
+            # is clocked locally at 148.5MHz (1.485Gb/s per lane) so that the
+            # input recovers it through the cable.
+            tx_clk_pll = Signal()
+            tx5x_clk_pll = Signal()
+            tx_mmcm_fb = Signal()
+            tx_mmcm_locked = Signal()
+            self.specials += [
+                Instance("MMCME2_BASE",
+                    p_BANDWIDTH="OPTIMIZED", i_RST=ResetSignal(), o_LOCKED=tx_mmcm_locked,
+
+                    # VCO @ 742.5MHz
+                    p_REF_JITTER1=0.01, p_CLKIN1_PERIOD=10.0,
+                    p_CLKFBOUT_MULT_F=37.125, p_CLKFBOUT_PHASE=0.000, p_DIVCLK_DIVIDE=5,
+                    i_CLKIN1=ClockSignal(), i_CLKFBIN=tx_mmcm_fb, o_CLKFBOUT=tx_mmcm_fb,
+
+                    # 148.5MHz
+                    p_CLKOUT0_DIVIDE_F=5.0, p_CLKOUT0_PHASE=0.000, o_CLKOUT0=tx_clk_pll,
+                    # 742.5MHz
+                    p_CLKOUT1_DIVIDE=1, p_CLKOUT1_PHASE=0.000, o_CLKOUT1=tx5x_clk_pll
+                ),
+            ]
+            self.clock_domains.cd_pix_tx = ClockDomain("pix_tx")
+            self.clock_domains.cd_pix5x_tx = ClockDomain("pix5x_tx", reset_less=True)
+            self.specials += [
+                Instance("BUFG", i_I=tx_clk_pll, o_O=self.cd_pix_tx.clk),
+                Instance("BUFIO", i_I=tx5x_clk_pll, o_O=self.cd_pix5x_tx.clk),
+                AsyncResetSynchronizer(self.cd_pix_tx, ~tx_mmcm_locked)
+            ]
+
+            tx = ClockDomainsRenamer({"pix": "pix_tx", "pix5x": "pix5x_tx"})
+            self.submodules.hdmi_output_clkgen = tx(S7HDMIOutEncoderSerializer(hdmi_out_pads.clk_p, hdmi_out_pads.clk_n, bypass_encoder=True))
+            self.comb += self.hdmi_output_clkgen.data.eq(Signal(10, reset=0b0000011111))
+            for i in range(3):
+                serializer = tx(S7HDMIOutEncoderSerializer(getattr(hdmi_out_pads, "data{}_p".format(i)),
+                                                           getattr(hdmi_out_pads, "data{}_n".format(i)),
+                                                           bypass_encoder=True))
+                generator = ClockDomainsRenamer("pix_tx")(PRBS7Generator())
+                self.submodules += serializer, generator
+                self.comb += serializer.data.eq(generator.o)
+        else:
+            self.submodules.hdmi_output_clkgen = S7HDMIOutEncoderSerializer(hdmi_out_pads.clk_p, hdmi_out_pads.clk_n, bypass_encoder=True)
+            self.submodules.hdmi_output = S7HDMIOutPHY(hdmi_out_pads)
+
+            self.comb += [
+                self.hdmi_output_clkgen.data.eq(Signal(10, reset=0b0000011111)),
+                self.hdmi_output.sink.valid.eq(1),
+                self.hdmi_output.sink.de.eq(output.de),
+                self.hdmi_output.sink.hsync.eq(output.hsync),
+                self.hdmi_output.sink.vsync.eq(output.vsync),
+                self.hdmi_output.sink.r.eq(output.r),
+                self.hdmi_output.sink.g.eq(output.g),
+                self.hdmi_output.sink.b.eq(output.b)
+            ]
         self.comb += hdmi_out_pads.scl.eq(1)
 
+class HDMICaptureSoC(SoCSDRAM):
+    csr_map = {
+        "ddrphy":  16,
+        "capture": 17,
+        "link":    18,
+        "timing":  19,
+        "latency": 20,
+        "ber":     21,
+        "ycbcr":   22,
+        "tiles":   23
+    }
+    csr_map.update(SoCSDRAM.csr_map)
+
+    def __init__(self, platform, prbs=False, ycbcr=False, **kwargs):
+        clk_freq = int(100e6)
+        SoCSDRAM.__init__(self, platform, clk_freq,
+            cpu_type=None,
+            l2_size=0,
+            csr_data_width=32,
+            with_uart=False,
+            ident="Artix-7 HDMI capture",
+            **kwargs)
+
+        self.submodules.hdmi = HDMILoopback(platform, prbs=prbs)
+
+        # host access to the csrs
+        self.submodules.bridge = UARTWishboneBridge(platform.request("serial"), clk_freq, baudrate=115200)
+        self.add_wb_master(self.bridge.wishbone)
+
+        # sdram
+        self.submodules.ddrphy = a7ddrphy.A7DDRPHY(platform.request("ddram"))
+        sdram_module = MT41K256M16(clk_freq, "1:4")
+        self.register_sdram(self.ddrphy,
+                            sdram_module.geom_settings,
+                            sdram_module.timing_settings)
+
+        # video timing
+        self.submodules.timing = TimingDetector(self.hdmi.pixels)
+
+        # frame capture, optionally as YCbCr 4:2:2
+        self.submodules.capture = FrameCapture(self.sdram.crossbar.get_port(mode="write"), ycbcr=ycbcr)
+        self.comb += self.capture.timing.eq(self.timing.timing)
+        if ycbcr:
+            self.submodules.ycbcr = RGBToYCbCr422()
+            self.comb += [
+                self.ycbcr.sink.eq(self.hdmi.pixels),
+                self.capture.sink.eq(self.ycbcr.source)
+            ]
+        else:
+            self.comb += self.capture.sink.eq(self.hdmi.pixels)
+
+        # changed tiles between frames
+        self.submodules.tiles = TileChangeDetector()
+        self.comb += self.tiles.sink.eq(self.hdmi.pixels)
+
+        # link health
+        self.submodules.link = LinkStatus(self.hdmi)
+
+        # input to output latency
+        self.submodules.latency = LatencyProbe(self.hdmi.vsync_in_edge, self.hdmi.vsync_out_edge)
+
+        # loopback bit error rate and eye margin
+        if prbs:
+            self.submodules.ber = BERTester(self.hdmi.channels)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Artix-7 HDMI processing")
+    parser.add_argument("--capture", action="store_true",
+                        help="build the SoC with DDR3 frame capture")
+    parser.add_argument("--prbs", action="store_true",
+                        help="send prbs7 instead of the loopback video, for bit error rate tests (implies --capture)")
+    parser.add_argument("--ycbcr", action="store_true",
+                        help="capture as YCbCr 4:2:2, 16 bits per pixel (implies --capture)")
+    parser.add_argument("--composite", action="store_true",
+                        help="loopback through the compositor, with a downscaled inset of the input")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="run vivado even if the sources are unchanged")
+    parser.add_argument("--incremental", action="store_true",
+                        help="incremental place and route from the last build of the same flow")
+    parser.add_argument("--toolchain-path", default="/opt/Xilinx/Vivado",
+                        help="vivado installation whose settings are sourced (vivado from the PATH if none)")
+    args = parser.parse_args()
+
+    # the bitstream ends up in build/top.bit (see load.py), from the cache
+    # when the generated sources and vivado script were already built
+    started = time.time()
     platform = nexys_video.Platform()
-    hdmi_loopback = HDMILoopback(platform)
-    platform.build(hdmi_loopback)
+    if args.capture or args.prbs or args.ycbcr:
+        soc = HDMICaptureSoC(platform, prbs=args.prbs, ycbcr=args.ycbcr)
+        builder = Builder(soc, output_dir="build", csr_csv="build/csr.csv")
+        flow = "-".join(["capture"] + [f for f in ["prbs", "ycbcr"] if getattr(args, f)])
+        generate = lambda: builder.build(run=False)
+        build_dir = os.path.join("build", "gateware")
+    else:
+        hdmi_loopback = HDMILoopback(platform, compositor=args.composite)
+        flow = "loopback-composite" if args.composite else "loopback"
+        generate = lambda: platform.build(hdmi_loopback, run=False)
+        build_dir = "build"
+
+    report = cached_build(generate, build_dir, flow,
+                          use_cache=not args.no_cache,
+                          incremental=args.incremental,
+                          settings=vivado_settings(args.toolchain_path),
+                          phases={"elaborate": time.time() - started})
+    print("{}: {} ({}), built {}{}".format(flow, "cache hit" if report["hit"] else "built", report["hash"][:16],
+        report["finished"], ", incremental from " + report["incremental"] if report.get("incremental") else ""))
+    for phase, seconds in sorted(report["phases"].items()):
+        print("  {:<24} {:8.1f}s".format(phase, seconds))
 
 
 if __name__ == "__main__":
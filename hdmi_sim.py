@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+import argparse
+import random
+
+import numpy as np
+
+from litex.gen import *
+from litex.gen.genlib.misc import WaitTimer
+
+import tmds
+from hdmi_design import HDMIInputChannel, ChannelBonding, SimMMCME2, InvalidSymbolDetector, valid_symbols
+from hdmi_design import (HDMIIn, pix_clock_bands, pix_clock_band_range, pix_clock_band_measurements,
+                         mmcm_vco_min, mmcm_vco_max)
+
+
+tap_delay = 1/(32*2*200e6) # IDELAYE2 tap with a 200MHz reference
+
+
+# small mode to keep simulations short
+sim_timing = tmds.VideoTiming(None,
+    256, 264, 296, 320,
+    16, 17, 18, 20,
+    1, 1)
+
+
+def generate_frames(nframes, timing=sim_timing, seed=0):
+    rng = np.random.RandomState(seed)
+    frames = rng.randint(0, 256, (nframes, timing.vactive, timing.hactive, 3)).astype(np.uint8)
+    symbols = np.concatenate([tmds.encode_frame(frame, timing) for frame in frames], axis=1)
+    de, data, ctl, valid = tmds.decode(symbols)
+    expected = [list(zip(de[i].tolist(), np.where(de[i], data[i], ctl[i]).tolist())) for i in range(3)]
+    return list(zip(symbols, expected))
+
+
+class TMDSLink:
+    def __init__(self, symbols, pixel_clock, skew=0.0, jitter=0.0, seed=0):
+        self.bits = tmds.serialize(symbols).tolist()
+        self.ui = 1/(10*pixel_clock)
+        self.skew = skew
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+
+    def sample(self, cycle, tap):
+        word = 0
+        for i in range(10):
+            t = (10*cycle + i + 0.5)*self.ui + self.skew - tap*tap_delay
+            if self.jitter:
+                t += self.rng.gauss(0, self.jitter)
+            word |= self.bits[int(t // self.ui) % len(self.bits)] << i
+        return word
+
+
+class ReceiverSim(Module):
+    def __init__(self):
+        self.submodules.mmcm = SimMMCME2()
+
+        reset_timer = WaitTimer(256)
+        self.submodules += reset_timer
+        self.comb += reset_timer.wait.eq(self.mmcm.locked)
+
+        self.submodules.bonding = ChannelBonding()
+        locked = Signal(3)
+
+        self.channels = []
+        for i in range(3):
+            chan = HDMIInputChannel(Signal(), sim=True)
+            self.submodules += chan
+            self.comb += [
+                chan.reset.eq(~reset_timer.done),
+                locked[i].eq(chan.locked),
+                self.bonding.data_in[i].de.eq(chan.data_valid),
+                self.bonding.data_in[i].d.eq(chan.data),
+                self.bonding.data_in[i].c.eq(chan.ctl)
+            ]
+            self.channels.append(chan)
+        self.comb += self.bonding.valid_i.eq(locked == 0b111)
+
+
+@passive
+def drive(chan, link):
+    cycle = 0
+    while True:
+        tap = yield chan.deserialiser.idelay.cntvalueout
+        yield chan.deserialiser.iserdes.samples.eq(link.sample(cycle, tap))
+        cycle += 1
+        yield
+
+
+# decoded symbols are recorded in segments, one per lock
+def capture(chan, ncycles, result):
+    result["decoded"] = []
+    result["segments"] = []
+    for cycle in range(ncycles):
+        if (yield chan.locked):
+            if "lock" not in result:
+                result["lock"] = cycle
+                result["segments"].append(len(result["decoded"]))
+                lock_cycles = yield chan.lock_cycles
+                if "lock_cycles" not in result:
+                    result["lock_cycles"] = lock_cycles
+                else:
+                    result.setdefault("relocks", []).append((lock_cycles, (yield chan.seeded)))
+            if (yield chan.data_valid):
+                result["decoded"].append((True, (yield chan.data)))
+            elif (yield chan.ctl_valid):
+                result["decoded"].append((False, (yield chan.ctl)))
+            else:
+                result["decoded"].append(None)
+        elif "lock" in result:
+            result.setdefault("losses", 0)
+            result["losses"] += 1
+            del result["lock"]
+        yield
+
+
+def capture_pixels(bonding, ncycles, result):
+    result["pixels"] = []
+    result["segments"] = []
+    for cycle in range(ncycles):
+        if not (yield bonding.synced):
+            if not result["segments"] or result["segments"][-1] != len(result["pixels"]):
+                result["segments"].append(len(result["pixels"]))
+        elif (yield bonding.valid):
+            pixel = []
+            for lane in bonding.data_out:
+                de = yield lane.de
+                pixel.append((bool(de), (yield lane.d) if de else (yield lane.c)))
+            result["pixels"].append(pixel)
+        yield
+
+
+def _find_start(decoded, expected, search=64):
+    best = None
+    for start in range(len(expected)):
+        errors = sum(decoded[i] != expected[(start + i) % len(expected)] for i in range(search))
+        if best is None or errors < best[0]:
+            best = (errors, start)
+        if errors == 0:
+            break
+    return best[1]
+
+
+def _split(items, segments):
+    bounds = [s for s in segments if s < len(items)] + [len(items)]
+    return [items[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+# each segment is matched against the stream on its own, too short ones are skipped
+def count_errors(decoded, expected, segments=[0], search=64):
+    errors = None
+    for segment in _split(decoded, segments):
+        if len(segment) < search:
+            continue
+        start = _find_start(segment, expected, search)
+        errors = (errors or 0) + sum(d != expected[(start + i) % len(expected)] for i, d in enumerate(segment))
+    return errors
+
+
+# pixels are only correct if all lanes carry the symbols sent at the same time
+def count_pixel_errors(pixels, expected, segments=[0], search=64):
+    errors = None
+    for segment in _split(pixels, segments):
+        if len(segment) < search:
+            continue
+        start = _find_start([p[0] for p in segment], expected[0], search)
+        errors = (errors or 0) + sum(any(p[i] != expected[i][(start + n) % len(expected[i])] for i in range(3))
+            for n, p in enumerate(segment))
+    return errors
+
+
+# cable replug: the mmcm loses lock and the channels restart
+def replug(mmcm, cycles, duration=64):
+    for cycle in range(max(cycles) + duration + 1):
+        yield mmcm.rst.eq(any(c <= cycle < c + duration for c in cycles))
+        yield
+
+
+def run(ncycles, pixel_clock, skews, jitter, seed=0, replugs=[]):
+    dut = ReceiverSim()
+    streams = generate_frames(2, seed=seed)
+    results = [{} for i in range(3)]
+    bonded = {}
+    generators = [capture_pixels(dut.bonding, ncycles, bonded)]
+    if replugs:
+        generators.append(replug(dut.mmcm, replugs))
+    for i, (chan, (symbols, expected)) in enumerate(zip(dut.channels, streams)):
+        link = TMDSLink(symbols, pixel_clock, skews[i], jitter, seed + i)
+        generators += [drive(chan, link), capture(chan, ncycles, results[i])]
+    # integer periods, pix is rounded to the nearest simulator tick
+    pix_period = 2*max(1, round(500e6/pixel_clock))
+    run_simulation(dut, {"pix": generators}, clocks={"sys": 20, "pix": pix_period})
+
+    for result, (symbols, expected) in zip(results, streams):
+        decoded = result["decoded"]
+        result["throughput"] = sum(d is not None for d in decoded)/max(1, len(decoded))
+        result["errors"] = count_errors(decoded, expected, result["segments"])
+    bonded["errors"] = count_pixel_errors(bonded["pixels"], [expected for symbols, expected in streams],
+                                          bonded["segments"])
+    return results, bonded
+
+
+# every code through one detector, returns invalid for each code
+def _detect_symbols(dut, symbol, invalid):
+    for cycle in range(1024 + dut.latency + 1):
+        yield symbol.eq(cycle % 1024)
+        yield
+        if cycle >= dut.latency:
+            invalid.append((yield dut.invalid))
+
+
+def check_symbol_detectors(implementations=("compare", "rom", "arithmetic")):
+    # exhaustive check of the InvalidSymbolDetector implementations against
+    # valid_symbols, returns the number of mismatching codes of each
+    valid = set(valid_symbols)
+    expected = [int(code not in valid) for code in range(1024)]
+    mismatches = {}
+    for implementation in implementations:
+        symbol = Signal(10, name="symbol")
+        dut = InvalidSymbolDetector(symbol, implementation)
+        invalid = []
+        run_simulation(dut, {"pix": _detect_symbols(dut, symbol, invalid)}, clocks={"sys": 10, "pix": 10})
+        mismatches[implementation] = sum(i != e for i, e in zip(invalid[:1024], expected)) + 1024 - len(invalid[:1024])
+    return mismatches
+
+
+def check_band_vco(clock_min=25000):
+    # VCO of every band over the pixel clocks (kHz) it holds, from the lowest
+    # HDMI pixel clock to the top of the last band. returns (band, low, high,
+    # vco_low, vco_high) of each band, with vco_high that of the last clock held
+    ranges = []
+    for band, (limit, divclk) in enumerate(pix_clock_bands):
+        low, high = pix_clock_band_range(band)
+        low = clock_min if low is None else max(low, clock_min)
+        high = pix_clock_bands[-1][0] + 1 if high is None else high
+        ranges.append((band, low, high, 40*low/divclk, 40*(high-1)/divclk))
+    return ranges
+
+
+# one pixel clock measurement every period sys cycles, records (measurement, band) of each reconfiguration
+def _select_bands(dut, values, period, starts):
+    yield dut.mmcm_reconfig.drp_rdy.eq(1)
+    for n, value in enumerate(values):
+        yield dut.frequency.value.eq(value)
+        for cycle in range(period):
+            yield dut.frequency.valid.eq(cycle == 0)
+            if (yield dut.mmcm_reconfig.start):
+                starts.append((n, (yield dut.mmcm_reconfig.config)))
+            yield
+
+
+def _band_pads():
+    pads = [("clk_p", 1), ("clk_n", 1), ("scl", 1), ("sda", 1), ("hpa", 1), ("txen", 1)]
+    pads += [("data{}_{}".format(i, p), 1) for i in range(3) for p in "pn"]
+    return Record(pads)
+
+
+def check_band_selection(period=64):
+    # walks a pixel clock down through every band limit and back up, with the
+    # clock first sitting on each limit (measurements alternating between both
+    # sides of it), then crossing it, and a jump across all the bands. returns
+    # the expected and the simulated (measurement, band) reconfigurations
+    n = pix_clock_band_measurements
+    nbands = len(pix_clock_bands)
+    values = [148500]*2*n
+    expected = []
+
+    def cross(inside, outside, band):
+        values.extend([outside, inside]*2*n + [outside]*n)
+        expected.append((len(values)-1, band))
+
+    for band in reversed(range(nbands-1)):
+        limit = pix_clock_bands[band][0]
+        cross(limit, limit-1, band)
+    for band in range(1, nbands):
+        limit = pix_clock_bands[band-1][0]
+        cross(limit-1, limit, band)
+    values.extend([25200]*n)
+    expected.append((len(values)-1, 0))
+    values.extend([148500]*n)
+    expected.append((len(values)-1, nbands-1))
+
+    dut = HDMIIn(_band_pads())
+    fragment = dut.get_fragment()
+    fragment.clock_domains.append(ClockDomain("sys"))
+    fragment.specials = {s for s in fragment.specials if not isinstance(s, Instance)}
+    starts = []
+    # the pixel clock domains only need to tick for the simulator
+    run_simulation(fragment, {"sys": _select_bands(dut, values, period, starts)},
+                   clocks={"sys": 10, "pix_in": 10*period, "pix": 10*period})
+    return expected, starts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HDMI receive path simulation")
+    parser.add_argument("--cycles", type=int, default=40000, help="pix cycles to simulate")
+    parser.add_argument("--pixel-clock", type=float, default=148.5, help="pixel clock (MHz)")
+    parser.add_argument("--skew", default="0,200,400", help="per-lane skew (ps)")
+    parser.add_argument("--jitter", type=float, default=20, help="random jitter (ps rms)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replug", default="", help="pix cycles at which the cable is replugged")
+    parser.add_argument("--check-symbols", action="store_true",
+                        help="only check every InvalidSymbolDetector implementation on all 1024 codes")
+    parser.add_argument("--check-bands", action="store_true",
+                        help="only check the VCO range of the pixel clock bands and the band selection")
+    args = parser.parse_args()
+
+    if args.check_symbols:
+        mismatches = check_symbol_detectors()
+        for implementation, errors in mismatches.items():
+            print("InvalidSymbolDetector {}: 1024 codes checked, {} mismatches".format(implementation, errors))
+        assert not any(mismatches.values())
+        return
+
+    if args.check_bands:
+        out_of_range = 0
+        for band, low, high, vco_low, vco_high in check_band_vco():
+            ok = mmcm_vco_min <= vco_low and vco_high <= mmcm_vco_max
+            out_of_range += not ok
+            print("band {}: {}..{} kHz, VCO {:.0f}..{:.0f} kHz{}".format(
+                band, low, high-1, vco_low, vco_high, "" if ok else " OUT OF RANGE"))
+        expected, starts = check_band_selection()
+        print("band selection: {} reconfigurations, {} expected".format(len(starts), len(expected)))
+        for (n, band), (expected_n, expected_band) in zip(starts, expected):
+            if (n, band) != (expected_n, expected_band):
+                print("band selection: band {} at measurement {}, expected band {} at {}".format(
+                    band, n, expected_band, expected_n))
+        assert not out_of_range
+        assert starts == expected
+        return
+
+    skews = [float(s)*1e-12 for s in args.skew.split(",")]
+    replugs = [int(c) for c in args.replug.split(",") if c]
+    results, bonded = run(args.cycles, args.pixel_clock*1e6, skews, args.jitter*1e-12,
+                          args.seed, replugs)
+    for i, result in enumerate(results):
+        if "lock_cycles" not in result:
+            print("channel {}: no lock".format(i))
+            continue
+        print("channel {}: lock after {} pix cycles, {} losses, throughput {:.3f}, {} errors in {} symbols".format(
+            i, result["lock_cycles"], result.get("losses", 0), result["throughput"],
+            result["errors"], len(result["decoded"])))
+        for lock_cycles, seeded in result.get("relocks", []):
+            print("channel {}: relock after {} pix cycles ({})".format(
+                i, lock_cycles, "last known good alignment" if seeded else "full search"))
+    print("bonded: {} pixel errors in {} pixels".format(bonded["errors"], len(bonded["pixels"])))
+
+
+if __name__ == "__main__":
+    main()
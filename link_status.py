@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Polls the link health CSRs of the capture SoC through litex_server, e.g.:
+#   litex_server uart /dev/ttyUSB1 115200 &
+#   ./link_status.py --interval 0.1 > link.log
+import argparse
+import time
+
+from litex.soc.tools.remote import RemoteClient
+
+
+channel_fields = ["locked", "delay_count", "word_offset", "signal_quality",
+                  "alignments", "symbol_errors", "locked_time", "lock_cycles", "seeded",
+                  "retrains"]
+link_fields = ["pix_clock", "frames", "lines", "bonded", "bonding_overflows"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HDMI input link health logger")
+    parser.add_argument("--csr-csv", default="build/csr.csv")
+    parser.add_argument("--port", type=int, default=1234, help="litex_server port")
+    parser.add_argument("--interval", type=float, default=0.5, help="polling interval (s)")
+    parser.add_argument("--count", type=int, default=0, help="number of samples (0: forever)")
+    parser.add_argument("--tick-bits", type=int, default=10, help="locked_time unit (log2 pix cycles)")
+    args = parser.parse_args()
+
+    wb = RemoteClient(port=args.port, csr_csv=args.csr_csv)
+    wb.open()
+
+    # all link registers are contiguous, read them with a single burst
+    names = ["link_" + f for f in link_fields]
+    names += ["link_chan{}_{}".format(i, f) for i in range(3) for f in channel_fields]
+    regs = [getattr(wb.regs, name) for name in names]
+    base = min(reg.addr for reg in regs)
+    length = (max(reg.addr for reg in regs) - base)//4 + 1
+
+    print("time\tpix_clock_khz\tfps\tlines\tbonded\tbonding_overflows\t" + "\t".join(
+        "ch{0}_locked\tch{0}_tap\tch{0}_offset\tch{0}_quality\tch{0}_alignments\tch{0}_errors_per_s\tch{0}_locked_s\t"
+        "ch{0}_lock_cycles\tch{0}_seeded\tch{0}_retrains".format(i)
+        for i in range(3)), flush=True)
+    last = None
+    n = 0
+    try:
+        while args.count == 0 or n < args.count:
+            wb.regs.link_update.write(1)
+            t = time.time()
+            words = wb.read(base, length)
+            values = {name: words[(reg.addr - base)//4] for name, reg in zip(names, regs)}
+
+            if last is not None:
+                dt = t - last[0]
+                pix_clock = values["link_pix_clock"]*1e3
+                line = ["{:.3f}".format(t), str(values["link_pix_clock"]),
+                        "{:.2f}".format(((values["link_frames"] - last[1]["link_frames"]) & 0xffffffff)/dt),
+                        str(values["link_lines"]), str(values["link_bonded"]),
+                        str(values["link_bonding_overflows"])]
+                for i in range(3):
+                    prefix = "link_chan{}_".format(i)
+                    errors = (values[prefix + "symbol_errors"] - last[1][prefix + "symbol_errors"]) & 0xffffffff
+                    locked_time = values[prefix + "locked_time"]*2**args.tick_bits/pix_clock if pix_clock else 0
+                    line += [str(values[prefix + f]) for f in channel_fields[:5]]
+                    line += ["{:.1f}".format(errors/dt), "{:.3f}".format(locked_time)]
+                    line += [str(values[prefix + f]) for f in channel_fields[7:]]
+                print("\t".join(line), flush=True)
+            last = (t, values)
+            n += 1
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+    wb.close()
+
+
+if __name__ == "__main__":
+    main()
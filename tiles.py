@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# Software model of the tile change detection (TileChangeDetector in
+# hdmi_design.py): dirty tile maps of frame sequences, synthetic desktop like
+# sequences and the capture bandwidth saved by only writing dirty tiles.
+import argparse
+
+import numpy as np
+
+import tmds
+
+
+tile_size = 16
+
+
+def dirty_tiles(previous, frame, tile=tile_size):
+    """(rows, cols) map of the tiles of frame that differ from previous, the
+    tiles at the right and bottom edges may be partial."""
+    changed = (np.asarray(previous) != np.asarray(frame)).any(axis=-1)
+    h, w = changed.shape
+    rows, cols = -(-h//tile), -(-w//tile)
+    padded = np.zeros((rows*tile, cols*tile), dtype=bool)
+    padded[:h, :w] = changed
+    return padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+
+def tile_areas(shape, tile=tile_size):
+    """(rows, cols) number of pixels of every tile of a frame."""
+    h, w = shape[:2]
+    heights = np.minimum(tile, h - np.arange(0, h, tile))
+    widths = np.minimum(tile, w - np.arange(0, w, tile))
+    return heights[:, None]*widths
+
+
+def desktop(nframes, width, height, seed=0):
+    # static background with a moving cursor, a blinking caret and a window
+    # that is redrawn from time to time
+    rng = np.random.RandomState(seed)
+    background = rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+    frame = background.copy()
+    for i in range(nframes):
+        frame = frame.copy()
+        x, y = (37*i) % (width - 12), (11*i) % (height - 20)
+        frame[y:y+20, x:x+12] = 255
+        frame[height//2:height//2+16, width//3] = 255*(i % 2)
+        if i % 10 == 9:
+            frame[height//4:height//2, width//4:width//2] = rng.randint(0, 256, 3)
+        yield frame
+
+
+def slides(nframes, width, height, seed=0, period=30):
+    rng = np.random.RandomState(seed)
+    frame = None
+    for i in range(nframes):
+        if i % period == 0:
+            frame = np.repeat(rng.randint(0, 256, (height//8, width//8, 3)), 8, axis=0).repeat(8, axis=1).astype(np.uint8)
+        yield frame
+
+
+def video(nframes, width, height, seed=0):
+    rng = np.random.RandomState(seed)
+    for i in range(nframes):
+        yield rng.randint(0, 256, (height, width, 3)).astype(np.uint8)
+
+
+sequences = {
+    "desktop": desktop,
+    "slides": slides,
+    "video": video
+}
+
+
+def bandwidth_saved(frames):
+    """Fraction of the pixels that need not be written when only the dirty
+    tiles of every frame after the first one are."""
+    previous = None
+    written = total = 0
+    for frame in frames:
+        if previous is not None:
+            areas = tile_areas(frame.shape)
+            written += areas[dirty_tiles(previous, frame)].sum()
+            total += areas.sum()
+        previous = frame
+    return 1 - written/total
+
+
+def simulate(frames, enables, hblank=4, vblank=3):
+    # runs TileChangeDetector on the frames (enable sampled at each frame
+    # start) and returns the tile strobes of every finished frame
+    from litex.gen.sim import run_simulation
+    from hdmi_design import TileChangeDetector
+
+    dut = TileChangeDetector()
+    height, width = frames[0].shape[:2]
+    groups = []
+
+    def generator():
+        yield dut.sink.valid.eq(1)
+        for frame, enable in zip(frames, enables):
+            # each frame starts with its vertical blanking, enable is set there
+            for y in range(-vblank, height):
+                for x in range(width + hblank):
+                    if (y, x) == (-vblank, 0):
+                        yield dut._enable.storage.eq(enable)
+                    de = y >= 0 and x < width
+                    yield dut.sink.de.eq(de)
+                    yield dut.sink.vsync.eq(y == 1 - vblank)
+                    if de:
+                        r, g, b = (int(v) for v in frame[y, x])
+                        yield dut.sink.r.eq(r)
+                        yield dut.sink.g.eq(g)
+                        yield dut.sink.b.eq(b)
+                    yield
+                    if (yield dut.tile_valid):
+                        index = yield dut.tile_index
+                        if index == 0:
+                            groups.append([])
+                        groups[-1].append(bool((yield dut.tile_dirty)))
+
+    run_simulation(dut, {"pix": generator()}, clocks={"sys": 10, "pix": 10})
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tile change detection model and check")
+    parser.add_argument("--mode", default="1920x1080@60", choices=sorted(tmds.video_timings.keys()))
+    parser.add_argument("--frames", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # hardware against the model, on small frames with partial edge tiles
+    frames = list(desktop(8, 40, 24, args.seed))
+    frames.insert(4, frames[3])
+    # detection frozen over frames 6 and 7: frame 8 is compared with frame 5
+    enables = [1]*6 + [0]*2 + [1]*2
+    frames += [frames[-1]]
+    groups = simulate(frames, enables)
+    expected = [dirty_tiles(frames[i-1], frames[i]).ravel().tolist() for i in range(1, 6)]
+    expected.append(dirty_tiles(frames[5], frames[8]).ravel().tolist())
+    # the first frame is compared with whatever was in the signatures, the
+    # last one is not complete
+    checked = groups[1:1+len(expected)]
+    errors = sum(g != e for g, e in zip(checked, expected)) + len(expected) - len(checked)
+    print("hardware: {} frames checked, {} mismatching dirty maps".format(len(expected), errors))
+
+    timing = tmds.video_timings[args.mode]
+    for name, sequence in sorted(sequences.items()):
+        saved = bandwidth_saved(sequence(args.frames, timing.hactive, timing.vactive, args.seed))
+        print("{} {}: {:.1f}% of the capture bandwidth saved".format(args.mode, name, 100*saved))
+
+
+if __name__ == "__main__":
+    main()
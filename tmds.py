@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# NumPy golden model of the DVI/HDMI TMDS link: encoder, serializer, decoder
+# and frame (re)assembly, vectorized so that whole frames can be generated and
+# checked at once (testbenches and offline analysis of captures).
+import argparse
+import time
+from collections import namedtuple
+
+import numpy as np
+
+
+control_tokens = [0b1101010100, 0b0010101011, 0b0101010100, 0b1010101011]
+
+VideoTiming = namedtuple("VideoTiming", [
+    "pix_clk",
+    "hactive", "hsync_start", "hsync_end", "hscan",
+    "vactive", "vsync_start", "vsync_end", "vscan",
+    "hsync_pol", "vsync_pol"])
+
+video_timings = {
+    "640x480@60": VideoTiming(25.175e6,
+        640, 656, 752, 800,
+        480, 490, 492, 525,
+        0, 0),
+    "1280x720@60": VideoTiming(74.25e6,
+        1280, 1390, 1430, 1650,
+        720, 725, 730, 750,
+        1, 1),
+    "1920x1080@60": VideoTiming(148.5e6,
+        1920, 2008, 2052, 2200,
+        1080, 1084, 1089, 1125,
+        1, 1),
+}
+
+
+def _transition_minimize(d):
+    n1 = bin(d).count("1")
+    xnor = n1 > 4 or (n1 == 4 and not d & 1)
+    q_m = d & 1
+    for i in range(1, 8):
+        q_m |= (((q_m >> (i-1)) ^ (d >> i) ^ xnor) & 1) << i
+    return q_m | (0 if xnor else 0x100)
+
+
+def _dc_balance(cnt, q_m):
+    diff = 2*bin(q_m & 0xff).count("1") - 8
+    xor = q_m >> 8
+    if cnt == 0 or diff == 0:
+        if xor:
+            return q_m, cnt + diff
+        else:
+            return 0x200 | (q_m ^ 0xff), cnt - diff
+    elif (cnt > 0) == (diff > 0):
+        return 0x200 | (q_m ^ 0xff), cnt + 2*xor - diff
+    else:
+        return q_m, cnt - 2*(1-xor) + diff
+
+
+def _build_tables():
+    q_m = [_transition_minimize(d) for d in range(256)]
+    # running disparity values reachable from the reset state
+    states = [0]
+    i = 0
+    while i < len(states):
+        for d in range(256):
+            cnt = _dc_balance(states[i], q_m[d])[1]
+            if cnt not in states:
+                states.append(cnt)
+        i += 1
+    symbol = np.zeros((len(states), 256), dtype=np.uint16)
+    next_state = np.zeros((len(states), 256), dtype=np.uint8)
+    for s, cnt in enumerate(states):
+        for d in range(256):
+            symbol[s, d], next_cnt = _dc_balance(cnt, q_m[d])
+            next_state[s, d] = states.index(next_cnt)
+
+    data = np.zeros(1024, dtype=np.uint8)
+    for q in range(1024):
+        v = q ^ 0xff if q & 0x200 else q
+        d = v & 1
+        for i in range(1, 8):
+            d |= (((v >> i) ^ (v >> (i-1)) ^ (not v & 0x100)) & 1) << i
+        data[q] = d
+    ctl = np.full(1024, -1, dtype=np.int8)
+    ctl[control_tokens] = np.arange(4)
+    valid = np.zeros(1024, dtype=bool)
+    valid[symbol.ravel()] = True
+    valid[control_tokens] = True
+    return symbol, next_state, data, ctl, valid
+
+_encode_symbol, _encode_next, _decode_data, _decode_ctl, symbol_valid = _build_tables()
+# flat lookups indexed by 256*state + byte
+_encode_symbol_flat = _encode_symbol.ravel()
+_encode_next_flat = 256*_encode_next.ravel().astype(np.intp)
+
+
+def encode(data, de, ctl):
+    """Encode (..., n) arrays of bytes/data enable/control along the last axis.
+
+    Disparity resets on control periods, so all leading rows are encoded in
+    parallel and only the position along the last axis is sequential."""
+    data = np.asarray(data, dtype=np.uint8)
+    de = np.broadcast_to(np.asarray(de, dtype=bool), data.shape)
+    ctl = np.broadcast_to(np.asarray(ctl, dtype=np.uint8), data.shape)
+    shape = data.shape
+    n = shape[-1]
+    # sequential axis first so that each step works on contiguous rows
+    data = np.ascontiguousarray(data.reshape(-1, n).T, dtype=np.intp)
+    de = np.ascontiguousarray(de.reshape(-1, n).T)
+    symbols = np.empty(data.shape, dtype=np.uint16)
+    state = np.zeros(data.shape[1], dtype=np.intp)
+    all_data = de.all()
+    for i in range(n):
+        k = state + data[i]
+        symbols[i] = _encode_symbol_flat.take(k)
+        state = _encode_next_flat.take(k)
+        if not all_data:
+            state[~de[i]] = 0
+    if not all_data:
+        tokens = np.array(control_tokens, dtype=np.uint16)[ctl.reshape(-1, n).T]
+        symbols = np.where(de, symbols, tokens)
+    return symbols.T.reshape(shape)
+
+
+def decode(symbols):
+    """Return (de, data, ctl, valid) arrays for an array of 10-bit symbols."""
+    symbols = np.asarray(symbols, dtype=np.uint16) & 0x3ff
+    ctl = _decode_ctl[symbols]
+    return ctl < 0, _decode_data[symbols], np.maximum(ctl, 0).astype(np.uint8), symbol_valid[symbols]
+
+
+def serialize(symbols):
+    """Bit stream (bit 0 of each symbol first) of an array of symbols."""
+    # groups of 4 symbols are 5 bytes, unpacked lsb first
+    symbols = np.asarray(symbols, dtype=np.uint16)
+    shape, n = symbols.shape[:-1], symbols.shape[-1]
+    m = -(-n//4)
+    s = np.zeros(shape + (m, 4), dtype=np.uint16)
+    s.reshape(shape + (-1,))[..., :n] = symbols & 0x3ff
+    s = [s[..., i] for i in range(4)]
+    packed = np.empty(shape + (m, 5), dtype=np.uint8)
+    packed[..., 0] = s[0]
+    packed[..., 1] = s[0] >> 8 | s[1] << 2
+    packed[..., 2] = s[1] >> 6 | s[2] << 4
+    packed[..., 3] = s[2] >> 4 | s[3] << 6
+    packed[..., 4] = s[3] >> 2
+    return np.unpackbits(packed.reshape(shape + (-1,)), axis=-1, count=10*n, bitorder="little")
+
+
+def deserialize(bits, offset=0):
+    """Symbols from a bit stream, starting at bit offset."""
+    bits = np.asarray(bits, dtype=np.uint8)[..., offset:]
+    shape, n = bits.shape[:-1], bits.shape[-1]//10
+    m = -(-n//4)
+    packed = np.zeros(shape + (5*m,), dtype=np.uint8)
+    packed[..., :-(-10*n//8)] = np.packbits(bits[..., :10*n], axis=-1, bitorder="little")
+    b = [packed[..., i::5].astype(np.uint16) for i in range(5)]
+    symbols = np.empty(shape + (m, 4), dtype=np.uint16)
+    symbols[..., 0] = b[0] | (b[1] & 0x03) << 8
+    symbols[..., 1] = b[1] >> 2 | (b[2] & 0x0f) << 6
+    symbols[..., 2] = b[2] >> 4 | (b[3] & 0x3f) << 4
+    symbols[..., 3] = b[3] >> 6 | b[4] << 2
+    return symbols.reshape(shape + (-1,))[..., :n]
+
+
+def timing_signals(timing):
+    """(de, hsync, vsync) arrays of shape (vscan, hscan) for one frame."""
+    x = np.arange(timing.hscan)
+    y = np.arange(timing.vscan)[:, None]
+    de = (x < timing.hactive) & (y < timing.vactive)
+    hsync = (x >= timing.hsync_start) & (x < timing.hsync_end)
+    vsync = (y >= timing.vsync_start) & (y < timing.vsync_end)
+    hsync = np.broadcast_to(hsync == bool(timing.hsync_pol), de.shape)
+    vsync = np.broadcast_to(vsync == bool(timing.vsync_pol), de.shape)
+    return de, hsync, vsync
+
+
+def encode_frame(frame, timing):
+    """Encode a (vactive, hactive, 3) RGB frame into (3, vscan*hscan) symbols.
+
+    Lane 0 carries blue and the syncs, lane 1 green, lane 2 red."""
+    de, hsync, vsync = timing_signals(timing)
+    tokens = np.array(control_tokens, dtype=np.uint16)
+    symbols = np.empty((3,) + de.shape, dtype=np.uint16)
+    symbols[0] = tokens[hsync | (vsync << 1)]
+    symbols[1:] = tokens[0]
+    # only the active area needs the sequential encoder
+    data = np.moveaxis(frame[..., ::-1], -1, 0)
+    symbols[:, :timing.vactive, :timing.hactive] = encode(data, True, 0)
+    return symbols.reshape(3, -1)
+
+
+def decode_frames(symbols):
+    """Reassemble RGB frames from (3, n) captured symbols.
+
+    Frames are cut on vsync (active edge taken from the sync polarity seen in
+    the capture) and lines on data enable, only complete frames are returned."""
+    de, data, ctl, valid = decode(symbols)
+    de = de.all(axis=0)
+    # vsync is only sent during control periods, hold it over data periods
+    last_control = np.maximum.accumulate(np.where(de, 0, np.arange(len(de))))
+    vsync = (ctl[0][last_control] >> 1) & 1
+    # the sync pulse is the minority state
+    if vsync.mean() > 0.5:
+        vsync = 1 - vsync
+    edges = np.flatnonzero(np.diff(vsync.astype(np.int8)) == 1) + 1
+    frames = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        frame_de = de[start:end].astype(np.int8)
+        line_starts = np.flatnonzero(np.diff(frame_de) == 1) + 1
+        line_ends = np.flatnonzero(np.diff(frame_de) == -1) + 1
+        if frame_de[0]:
+            line_starts = np.insert(line_starts, 0, 0)
+        line_ends = line_ends[line_ends > line_starts[0]] if len(line_starts) else line_ends
+        n = min(len(line_starts), len(line_ends))
+        if n == 0:
+            continue
+        lengths = line_ends[:n] - line_starts[:n]
+        if (lengths != lengths[0]).any():
+            continue
+        index = start + line_starts[:n, None] + np.arange(lengths[0])
+        frames.append(np.stack([data[2][index], data[1][index], data[0][index]], axis=-1))
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TMDS golden model throughput check")
+    parser.add_argument("--mode", default="1920x1080@60", choices=sorted(video_timings.keys()))
+    parser.add_argument("--frames", type=int, default=4)
+    args = parser.parse_args()
+
+    timing = video_timings[args.mode]
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 256, (timing.vactive, timing.hactive, 3)).astype(np.uint8)
+              for i in range(args.frames)]
+
+    t0 = time.time()
+    symbols = np.concatenate([encode_frame(f, timing) for f in frames], axis=1)
+    t1 = time.time()
+    bits = serialize(symbols)
+    symbols = deserialize(bits)
+    t2 = time.time()
+    decoded = decode_frames(symbols)
+    t3 = time.time()
+
+    ok = all((a == b).all() for a, b in zip(frames[1:], decoded))
+    print("{}: encode {:.1f} frames/s, serialize+deserialize {:.1f} frames/s, decode {:.1f} frames/s, {} frames checked: {}".format(
+        args.mode, args.frames/(t1 - t0), args.frames/(t2 - t1), args.frames/(t3 - t2),
+        len(decoded), "ok" if ok and decoded else "MISMATCH"))
+
+
+if __name__ == "__main__":
+    main()